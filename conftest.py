@@ -0,0 +1,15 @@
+import pytest
+from django.test.utils import override_settings
+
+from core.test_runner import isolated_cache_settings
+
+
+@pytest.fixture(scope='session', autouse=True)
+def isolated_default_cache(tmp_path_factory):
+    """Кэш default на время прогона во временном файле, как
+    в core.test_runner.TestRunner: py.test не смотрит на TEST_RUNNER,
+    а тесты чистят кэш и стирали бы кэш runserver.
+    """
+    directory = tmp_path_factory.mktemp('cache')
+    with override_settings(CACHES=isolated_cache_settings(str(directory))):
+        yield
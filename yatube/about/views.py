@@ -1,9 +1,14 @@
+from django.utils.decorators import method_decorator
 from django.views.generic.base import TemplateView
 
+from core.decorators import query_budget
 
+
+@method_decorator(query_budget(2), name='dispatch')
 class AboutAuthorView(TemplateView):
     template_name = 'about/author.html'
 
 
+@method_decorator(query_budget(2), name='dispatch')
 class AboutTechView(TemplateView):
     template_name = 'about/tech.html'
@@ -0,0 +1,414 @@
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import metrics
+
+# Вместо NULL для «бессрочных» записей: так вытеснение по индексу
+# на expires трогает их последними.
+NEVER = 2 ** 62
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY,'
+    ' value BLOB NOT NULL,'
+    ' expires REAL NOT NULL,'
+    ' size INTEGER NOT NULL'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+)
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в локальном файле SQLite в режиме WAL, общий для всех
+    WSGI-воркеров на хосте и не требующий отдельного сервера.
+
+    Целые числа хранятся как INTEGER, поэтому incr — один атомарный
+    UPDATE; остальные значения сериализуются pickle. Истёкшие записи
+    и переполнение по MAX_ENTRIES или MAX_SIZE (байт) вычищаются
+    в среднем раз в CULL_EVERY записей.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache_backends.SQLiteCache',
+            'LOCATION': '/var/cache/yatube/cache.sqlite3',
+            'OPTIONS': {'MAX_ENTRIES': 100000, 'MAX_SIZE': 256 * 2 ** 20},
+        }
+    }
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = location
+        self.max_size = options.get('MAX_SIZE')
+        self.cull_every = options.get('CULL_EVERY', 100)
+        self.busy_timeout = options.get('BUSY_TIMEOUT', 5)
+        self._local = threading.local()
+
+    def _connection(self):
+        # Соединение своё у каждого потока и каждого процесса после fork.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=self.busy_timeout,
+                isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _expires(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        return NEVER if expires is None else expires
+
+    @staticmethod
+    def _encode(value):
+        if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _decode(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    @staticmethod
+    def _size(encoded):
+        return 8 if isinstance(encoded, int) else len(encoded)
+
+    def _prepare(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _write(self, rows):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires, size) '
+                'VALUES (?, ?, ?, ?)', rows)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self._maybe_cull()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._prepare(key, version)
+        encoded = self._encode(value)
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (key, time.time()))
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires, size) '
+                'VALUES (?, ?, ?, ?)',
+                (key, encoded, self._expires(timeout), self._size(encoded)))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self._maybe_cull()
+        return cursor.rowcount == 1
+
+    def get(self, key, default=None, version=None):
+        key = self._prepare(key, version)
+        with metrics.timer('cache'):
+            row = self._connection().execute(
+                'SELECT value FROM cache WHERE key = ? AND expires > ?',
+                (key, time.time())).fetchone()
+        if row is None:
+            metrics.record_cache(misses=1)
+            return default
+        metrics.record_cache(hits=1)
+        return self._decode(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self._prepare(key, version): key for key in keys}
+        if not keys:
+            return {}
+        with metrics.timer('cache'):
+            rows = self._connection().execute(
+                'SELECT key, value FROM cache WHERE expires > ? AND key IN '
+                '(%s)' % ', '.join('?' * len(keys)),
+                [time.time(), *keys]).fetchall()
+        metrics.record_cache(hits=len(rows), misses=len(keys) - len(rows))
+        return {keys[key]: self._decode(value) for key, value in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        encoded = self._encode(value)
+        self._write([(self._prepare(key, version), encoded,
+                      self._expires(timeout), self._size(encoded))])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self._expires(timeout)
+        rows = []
+        for key, value in data.items():
+            encoded = self._encode(value)
+            rows.append((self._prepare(key, version), encoded, expires,
+                         self._size(encoded)))
+        if rows:
+            self._write(rows)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self._connection().execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND expires > ?',
+            (self._expires(timeout), self._prepare(key, version),
+             time.time()))
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self._prepare(key, version)
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                "UPDATE cache SET value = value + ? WHERE key = ? "
+                "AND expires > ? AND typeof(value) = 'integer'",
+                (delta, key, time.time()))
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? AND expires > ?',
+                (key, time.time())).fetchone()
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if row is None:
+            raise ValueError("Key '%s' not found" % key)
+        value = self._decode(row[0])
+        if not isinstance(value, int):
+            raise TypeError("Key '%s' does not hold an integer" % key)
+        return value
+
+    def delete(self, key, version=None):
+        self._connection().execute(
+            'DELETE FROM cache WHERE key = ?', (self._prepare(key, version),))
+
+    def delete_many(self, keys, version=None):
+        keys = [self._prepare(key, version) for key in keys]
+        if keys:
+            self._connection().execute(
+                'DELETE FROM cache WHERE key IN (%s)'
+                % ', '.join('?' * len(keys)), keys)
+
+    def has_key(self, key, version=None):
+        row = self._connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? AND expires > ?',
+            (self._prepare(key, version), time.time())).fetchone()
+        return row is not None
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Соединения живут всё время жизни потока: открывать файл на каждый
+        # запрос дороже, чем держать его открытым.
+        pass
+
+    def _maybe_cull(self):
+        if random.randrange(self.cull_every) == 0:
+            self.cull()
+
+    def cull(self):
+        """Удаляет истёкшие записи, затем самые близкие к истечению,
+        пока кэш не уложится в MAX_ENTRIES и MAX_SIZE.
+        """
+        connection = self._connection()
+        connection.execute('DELETE FROM cache WHERE expires <= ?',
+                           (time.time(),))
+        if self._cull_frequency == 0:
+            self.clear()
+            return
+        count, size = connection.execute(
+            'SELECT count(*), total(size) FROM cache').fetchone()
+        excess = count - self._max_entries
+        if self.max_size and size > self.max_size:
+            average = size / count
+            excess = max(excess, int((size - self.max_size) / average) + 1)
+        if excess <= 0:
+            return
+        # Как и встроенные бэкенды, чистим с запасом, чтобы не упираться
+        # в лимит на каждой записи.
+        excess += count // self._cull_frequency
+        connection.execute(
+            'DELETE FROM cache WHERE key IN ('
+            ' SELECT key FROM cache ORDER BY expires LIMIT ?)', (excess,))
+
+
+class LayeredCache(BaseCache):
+    """Двухуровневый кэш: ограниченный LRU в памяти процесса (L1) перед
+    общим кэшем из LOCATION (L2, алиас из CACHES).
+
+    Записи в L1 живут не дольше L1_TIMEOUT секунд, а удаление в другом
+    процессе до них не доходит. Поэтому значения, которые меняются,
+    нужно класть под ключами с версией: после смены версии старый ключ
+    в L1 просто перестаёт запрашиваться. Значения из L1 отдаются без
+    копирования — их нельзя изменять.
+
+    CACHES = {
+        'posts': {
+            'BACKEND': 'core.cache_backends.LayeredCache',
+            'LOCATION': 'default',
+            'OPTIONS': {'L1_MAX_ENTRIES': 5000, 'L1_TIMEOUT': 60},
+        }
+    }
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l2_alias = location or 'default'
+        self.l1_max_entries = options.get('L1_MAX_ENTRIES', 1000)
+        self.l1_timeout = options.get('L1_TIMEOUT', 60)
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0}
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def _l1_get(self, key):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires <= time.time():
+                del self._l1[key]
+                return False, None
+            self._l1.move_to_end(key)
+            return True, value
+
+    def _l1_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        expires = self.get_backend_timeout(timeout)
+        l1_expires = time.time() + self.l1_timeout
+        if expires is not None:
+            l1_expires = min(expires, l1_expires)
+        with self._lock:
+            self._l1[key] = (l1_expires, value)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._l1.pop(key, None)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version=version)
+        found, value = self._l1_get(local_key)
+        if found:
+            self._count('l1_hits')
+            # Промахи L1 учтёт L2.
+            metrics.record_cache(hits=1)
+            return value
+        sentinel = object()
+        value = self.l2.get(key, sentinel, version=version)
+        if value is sentinel:
+            self._count('misses')
+            return default
+        self._count('l2_hits')
+        self._l1_set(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found, missing = {}, []
+        for key in keys:
+            hit, value = self._l1_get(self.make_key(key, version=version))
+            if hit:
+                found[key] = value
+            else:
+                missing.append(key)
+        self._count('l1_hits', len(found))
+        metrics.record_cache(hits=len(found))
+        if missing:
+            from_l2 = self.l2.get_many(missing, version=version)
+            self._count('l2_hits', len(from_l2))
+            self._count('misses', len(missing) - len(from_l2))
+            for key, value in from_l2.items():
+                self._l1_set(self.make_key(key, version=version), value)
+            found.update(from_l2)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version=version)
+        self._l1_set(self.make_key(key, version=version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._l1_set(self.make_key(key, version=version), value,
+                             timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            self._l1_set(self.make_key(key, version=version), value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._l1_delete(self.make_key(key, version=version))
+        return self.l2.incr(key, delta, version=version)
+
+    def delete(self, key, version=None):
+        self._l1_delete(self.make_key(key, version=version))
+        self.l2.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        self._l1_delete(*(self.make_key(key, version=version)
+                          for key in keys))
+        self.l2.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        found, _ = self._l1_get(self.make_key(key, version=version))
+        return found or self.l2.has_key(key, version=version)
+
+    def clear(self):
+        self.clear_local()
+        self.l2.clear()
+
+    def clear_local(self):
+        with self._lock:
+            self._l1.clear()
+
+    def stats(self):
+        """Попадания по уровням этого процесса и доли попаданий."""
+        with self._lock:
+            stats = dict(self._stats, l1_size=len(self._l1))
+        requests = stats['l1_hits'] + stats['l2_hits'] + stats['misses']
+        l2_requests = stats['l2_hits'] + stats['misses']
+        stats['l1_hit_rate'] = (
+            stats['l1_hits'] / requests if requests else 0.0)
+        stats['l2_hit_rate'] = (
+            stats['l2_hits'] / l2_requests if l2_requests else 0.0)
+        return stats
@@ -0,0 +1,233 @@
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+ENTRY_KEY = 'swr:{view}:{key}'
+LOCK_KEY = 'swr:lock:{view}:{key}'
+STATS_KEY = 'swr:stats:{view}:{outcome}'
+
+HIT = 'hit'
+MISS = 'miss'
+STALE = 'stale'
+OUTCOMES = (HIT, MISS, STALE)
+
+
+class _Counters:
+    """Счётчики hit/miss/stale этого процесса. В общий кэш они уходят
+    одним incr на ключ не чаще раза в CACHE_SWR_STATS_FLUSH_INTERVAL
+    секунд, а не записью на каждый запрос: попадание в кэш — самый
+    частый путь, и с SQLiteCache каждая запись — транзакция. Ещё не
+    сброшенные счётчики теряются при остановке процесса.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushed_at = time.monotonic()
+
+    def add(self, view_name, outcome):
+        key = STATS_KEY.format(view=view_name, outcome=outcome)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+            now = time.monotonic()
+            interval = settings.CACHE_SWR_STATS_FLUSH_INTERVAL
+            if now - self._flushed_at < interval:
+                return
+            pending, self._pending = self._pending, {}
+            self._flushed_at = now
+        for key, amount in pending.items():
+            try:
+                cache.incr(key, amount)
+            except ValueError:
+                if not cache.add(key, amount, None):
+                    cache.incr(key, amount)
+
+    def pending(self, key):
+        with self._lock:
+            return self._pending.get(key, 0)
+
+    def reset(self):
+        with self._lock:
+            self._pending.clear()
+            self._flushed_at = time.monotonic()
+
+
+_counters = _Counters()
+
+
+def reset_stats():
+    """Забывает несброшенные счётчики процесса (для тестов)."""
+    _counters.reset()
+
+
+def get_stats(view_name):
+    """Счётчики попаданий, промахов и отданных устаревших страниц:
+    сброшенные в общий кэш всеми процессами плюс ещё не сброшенные
+    в этом.
+    """
+    keys = {STATS_KEY.format(view=view_name, outcome=outcome): outcome
+            for outcome in OUTCOMES}
+    values = cache.get_many(keys)
+    return {outcome: values.get(key, 0) + _counters.pending(key)
+            for key, outcome in keys.items()}
+
+
+def _cacheable(request, response):
+    return (response.status_code == 200 and not response.streaming
+            and not response.cookies)
+
+
+def _wait_for_entry(entry_key, wait_for):
+    deadline = time.time() + wait_for
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(entry_key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def cache_page_swr(key_func, version_func=None, timeout=None,
+                   stale_timeout=None, lock_timeout=None):
+    """Замена cache_page для нагруженных страниц (stale-while-revalidate).
+
+    Запись считается свежей timeout секунд и пока совпадает версия из
+    version_func. Устаревшую запись перестраивает только тот воркер,
+    который взял блокировку в кэше (cache.add); остальные в это время
+    отдают устаревшую страницу, а при полном отсутствии записи — ждут её
+    до lock_timeout секунд. Блокировка истекает сама, если воркер упал.
+    """
+    def decorator(view):
+        view_name = '%s.%s' % (view.__module__, view.__name__)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            fresh_for = timeout or settings.CACHE_SWR_TIMEOUT
+            stale_for = stale_timeout or settings.CACHE_SWR_STALE_TIMEOUT
+            lock_for = lock_timeout or settings.CACHE_SWR_LOCK_TIMEOUT
+            key = key_func(request, *args, **kwargs)
+            entry_key = ENTRY_KEY.format(view=view_name, key=key)
+            lock_key = LOCK_KEY.format(view=view_name, key=key)
+            version = version_func(request, *args, **kwargs) \
+                if version_func else None
+
+            entry = cache.get(entry_key)
+            if entry is not None and entry['version'] == version and (
+                    time.time() < entry['fresh_until']):
+                _counters.add(view_name, HIT)
+                return entry['response']
+
+            locked = cache.add(lock_key, 1, lock_for)
+            if not locked:
+                entry = entry or _wait_for_entry(entry_key, lock_for)
+                if entry is not None:
+                    _counters.add(view_name, STALE)
+                    return entry['response']
+
+            _counters.add(view_name, MISS)
+            try:
+                response = view(request, *args, **kwargs)
+                if _cacheable(request, response):
+                    cache.set(entry_key, {
+                        'response': response,
+                        'version': version,
+                        'fresh_until': time.time() + fresh_for,
+                    }, fresh_for + stale_for)
+            finally:
+                # Не дождавшись чужой страницы, воркер строит её сам, но
+                # блокировку владельца не трогает.
+                if locked:
+                    cache.delete(lock_key)
+            return response
+        return wrapper
+    return decorator
+
+
+class QueryBudgetExceeded(Exception):
+    """View сделала больше SQL-запросов, чем указано в query_budget."""
+
+
+def _query_origin(frame, stop):
+    """Откуда сделан запрос: кадры кода проекта и узлы шаблонов,
+    от ближайшего к запросу до кадра stop (обёртки view).
+    """
+    lines = []
+    while frame is not None and frame is not stop:
+        code = frame.f_code
+        node = frame.f_locals.get('self')
+        if code.co_name == 'render_annotated' and getattr(
+                node, 'origin', None) and getattr(node, 'token', None):
+            lines.append('  %s:%s {%% %s %%}' % (
+                node.origin.template_name, node.token.lineno,
+                node.token.contents[:60]))
+        elif (code.co_filename.startswith(settings.BASE_DIR)
+                and 'site-packages' not in code.co_filename):
+            lines.append('  %s:%s in %s' % (
+                os.path.relpath(code.co_filename, settings.BASE_DIR),
+                frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    return lines
+
+
+def _view_name(view, request):
+    # method_decorator передаёт сюда functools.partial без имени.
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        return match.view_name
+    return getattr(view, '__qualname__', repr(view))
+
+
+def query_budget(limit):
+    """Не больше limit SQL-запросов на вызов view (с холодным кэшем,
+    вместе с запросами сессии и пользователя).
+
+    При превышении стек запроса, вышедшего за бюджет, пишется в лог
+    с уровнем WARNING, а при QUERY_BUDGET_STRICT (в тестах) view падает
+    с QueryBudgetExceeded. TemplateResponse рендерится внутри обёртки,
+    чтобы учесть запросы из шаблона. Для классов — через
+    method_decorator(query_budget(n), name='dispatch').
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            state = {'count': 0, 'origin': None}
+            outer = sys._getframe()
+
+            def count(execute, sql, params, many, context):
+                state['count'] += 1
+                if state['count'] == limit + 1:
+                    state['origin'] = (
+                        sql, _query_origin(sys._getframe(1), outer))
+                return execute(sql, params, many, context)
+
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(count))
+                response = view(request, *args, **kwargs)
+                if callable(getattr(response, 'render', None)) and (
+                        not response.is_rendered):
+                    response.render()
+            if state['count'] > limit:
+                sql, origin = state['origin']
+                message = '%s: %d SQL-запросов при бюджете %d.\n' % (
+                    _view_name(view, request), state['count'], limit)
+                message += 'Первый лишний: %s\n%s' % (sql, '\n'.join(origin))
+                if settings.QUERY_BUDGET_STRICT:
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+            return response
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
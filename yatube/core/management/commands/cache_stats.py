@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.decorators import OUTCOMES, get_stats
+
+DEFAULT_VIEWS = (
+    'posts.views.index',
+    'posts.views.group_posts',
+    'posts.views.profile',
+)
+
+
+class Command(BaseCommand):
+    help = 'Показывает счётчики hit/miss/stale страниц с cache_page_swr.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'views', nargs='*', default=DEFAULT_VIEWS,
+            help='Полные имена view, например posts.views.index.')
+
+    def handle(self, *args, views, **options):
+        for view in views:
+            stats = get_stats(view)
+            total = sum(stats.values())
+            hit_rate = stats['hit'] / total if total else 0
+            counters = ' '.join(
+                f'{outcome}={stats[outcome]}' for outcome in OUTCOMES)
+            self.stdout.write(f'{view}: {counters} hit_rate={hit_rate:.1%}')
@@ -0,0 +1,93 @@
+"""Метрики текущего запроса: число и время SQL-запросов, время шаблонов,
+кэша и превью, попадания в кэш.
+
+Метрики лежат в contextvar, который ставит ServerTimingMiddleware.
+Вне запроса (management-команды, фоновые задачи в других потоках)
+current() возвращает None, и всё учётное здесь ничего не делает.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+# Порядок метрик времени в заголовке Server-Timing.
+TIMINGS = ('db', 'template', 'cache', 'thumbnails')
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.durations = {name: 0.0 for name in TIMINGS}
+        self.total = 0.0
+
+    def query_wrapper(self, execute, sql, params, many, context):
+        """Для connection.execute_wrapper: считает запросы и их время."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations['db'] += time.perf_counter() - started
+            self.queries += 1
+
+    def as_dict(self):
+        data = {name + '_ms': round(duration * 1000, 2)
+                for name, duration in self.durations.items()}
+        data.update(
+            total_ms=round(self.total * 1000, 2),
+            queries=self.queries,
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses,
+        )
+        return data
+
+    def server_timing(self):
+        """Значение заголовка Server-Timing."""
+        descriptions = {
+            'db': '%d queries' % self.queries,
+            'cache': 'hit=%d miss=%d' % (self.cache_hits, self.cache_misses),
+        }
+        entries = []
+        for name in TIMINGS:
+            entry = '%s;dur=%.1f' % (name, self.durations[name] * 1000)
+            if name in descriptions:
+                entry += ';desc="%s"' % descriptions[name]
+            entries.append(entry)
+        entries.append('total;dur=%.1f' % (self.total * 1000))
+        return ', '.join(entries)
+
+
+def begin():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def end(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def timer(name):
+    """Добавляет время блока к метрике name текущего запроса."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.durations[name] += time.perf_counter() - started
+
+
+def record_cache(hits=0, misses=0):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
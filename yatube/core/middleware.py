@@ -0,0 +1,55 @@
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ServerTimingMiddleware:
+    """Замеряет SQL, шаблоны, кэш и превью в доле SERVER_TIMING_SAMPLE_RATE
+    запросов. Результат пишется строкой key=value в лог core.middleware
+    (сами числа лежат в extra['metrics'] записи лога), а если включён
+    SERVER_TIMING_HEADER — ещё и в заголовок Server-Timing, но только
+    для сотрудников (is_staff): остальным внутренние метрики не видны.
+
+    Остальные запросы проходят без обёрток. Ставить её нужно первой
+    в MIDDLEWARE, чтобы total включал остальные middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.SERVER_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+        request_metrics, token = metrics.begin()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(
+                        request_metrics.query_wrapper))
+                response = self.get_response(request)
+        finally:
+            metrics.end(token)
+        request_metrics.total = time.perf_counter() - started
+        if settings.SERVER_TIMING_HEADER and self.is_staff(request):
+            response['Server-Timing'] = request_metrics.server_timing()
+        data = request_metrics.as_dict()
+        logger.info(
+            'method=%s path=%s status=%s %s', request.method,
+            request.path, response.status_code,
+            ' '.join('%s=%s' % item for item in data.items()),
+            extra={'metrics': data})
+        return response
+
+    @staticmethod
+    def is_staff(request):
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
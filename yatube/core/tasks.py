@@ -0,0 +1,68 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.BACKGROUND_TASKS_WORKERS,
+            thread_name_prefix='yatube-tasks',
+        )
+    return _executor
+
+
+@contextmanager
+def _without_request_wrappers():
+    # Задача, выполняемая в потоке запроса, не должна попадать ни в бюджет
+    # запросов view, ни в его метрики: в бою она идёт в своём потоке.
+    wrappers = connection.execute_wrappers
+    connection.execute_wrappers = []
+    try:
+        yield
+    finally:
+        connection.execute_wrappers = wrappers
+
+
+def _run_inline(func, args, kwargs):
+    try:
+        with _without_request_wrappers():
+            func(*args, **kwargs)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой',
+                         func.__name__)
+
+
+def _run(func, args, kwargs):
+    try:
+        _run_inline(func, args, kwargs)
+    finally:
+        # У каждого потока своё соединение с БД, закрываем его сами.
+        connection.close()
+
+
+def submit(func, *args, **kwargs):
+    """Выполняет func в фоновом пуле потоков после коммита транзакции.
+
+    С BACKGROUND_TASKS_EAGER = True задача выполняется сразу в текущем
+    потоке (удобно для тестов и management-команд).
+    """
+    if settings.BACKGROUND_TASKS_EAGER:
+        with _without_request_wrappers():
+            func(*args, **kwargs)
+        return
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        # Другие потоки не могут писать в in-memory базу (тесты)
+        # параллельно с основным, поэтому задача выполняется в нём же.
+        transaction.on_commit(lambda: _run_inline(func, args, kwargs))
+        return
+    transaction.on_commit(
+        lambda: get_executor().submit(_run, func, args, kwargs))
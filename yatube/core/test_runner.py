@@ -0,0 +1,38 @@
+import copy
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+def isolated_cache_settings(directory):
+    """CACHES, в которых кэш default лежит в файле внутри directory."""
+    cache_settings = copy.deepcopy(settings.CACHES)
+    cache_settings['default']['LOCATION'] = os.path.join(
+        directory, 'default.sqlite3')
+    return cache_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Кэш default на время прогона переезжает во временный файл: тесты
+    чистят кэш, и без этого они стирали бы кэш runserver и мешали
+    соседним прогонам (для py.test то же делает conftest.py). View,
+    вышедшая за свой query_budget, падает с QueryBudgetExceeded, а не
+    пишет предупреждение в лог.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_dir = tempfile.mkdtemp(prefix='yatube-test-cache-')
+        self._test_settings = override_settings(
+            CACHES=isolated_cache_settings(self._cache_dir),
+            QUERY_BUDGET_STRICT=True)
+        self._test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        shutil.rmtree(self._cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
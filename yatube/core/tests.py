@@ -0,0 +1,232 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.template import engines
+from django.template.response import SimpleTemplateResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.urls import reverse
+
+from posts.models import Post
+
+from .cache_backends import LayeredCache, SQLiteCache
+from .decorators import QueryBudgetExceeded, query_budget
+
+User = get_user_model()
+
+
+class TestRunnerTest(SimpleTestCase):
+    def test_default_cache_is_private_to_the_run(self):
+        self.assertTrue(caches['default'].path.startswith(
+            os.path.join(tempfile.gettempdir(), 'yatube-test-cache-')))
+
+    def test_query_budgets_are_strict(self):
+        self.assertTrue(settings.QUERY_BUDGET_STRICT)
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.path, {'OPTIONS': options})
+
+    def test_values_are_shared_between_instances(self):
+        """Два экземпляра на одном файле ведут себя как два воркера."""
+        other = self.make_cache()
+        self.cache.set('page', {'html': 'текст'})
+        self.assertEqual(other.get('page'), {'html': 'текст'})
+        other.delete('page')
+        self.assertIsNone(self.cache.get('page'))
+
+    def test_add_and_incr_are_atomic(self):
+        other = self.make_cache()
+        self.assertTrue(self.cache.add('lock', 1))
+        self.assertFalse(other.add('lock', 1))
+        self.assertEqual(other.incr('lock'), 2)
+        self.assertEqual(self.cache.incr('lock', 10), 12)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_expired_entries_are_ignored_and_replaced(self):
+        self.cache.set('key', 'old', timeout=0)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 'new'))
+        self.assertEqual(self.cache.get_many(['key', 'other']),
+                         {'key': 'new'})
+
+    def test_cull_respects_entry_and_size_caps(self):
+        cache = self.make_cache(MAX_ENTRIES=10, CULL_FREQUENCY=10)
+        cache.set_many({f'key{i}': i for i in range(20)})
+        cache.cull()
+        self.assertLessEqual(
+            len(cache.get_many([f'key{i}' for i in range(20)])), 10)
+
+        cache.clear()
+        cache = self.make_cache(MAX_SIZE=5000, CULL_FREQUENCY=10)
+        cache.set_many({f'blob{i}': b'x' * 1000 for i in range(10)})
+        cache.cull()
+        self.assertLessEqual(
+            len(cache.get_many([f'blob{i}' for i in range(10)])), 5)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class LayeredCacheTest(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        return LayeredCache('default', {'OPTIONS': options})
+
+    def test_second_read_is_served_from_memory(self):
+        self.cache.set('fragment', '<article>')
+        caches['default'].delete('fragment')
+        self.assertEqual(self.cache.get('fragment'), '<article>')
+        other = self.make_cache()
+        self.assertIsNone(other.get('fragment'))
+        stats = self.cache.stats()
+        self.assertEqual(stats['l1_hits'], 1)
+        self.assertEqual(stats['l1_hit_rate'], 1.0)
+
+    def test_miss_in_memory_is_filled_from_shared_cache(self):
+        caches['default'].set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']),
+                         {'a': 1, 'b': 2})
+        self.assertEqual(self.cache.get('a'), 1)
+        stats = self.cache.stats()
+        self.assertEqual(
+            (stats['l1_hits'], stats['l2_hits'], stats['misses']),
+            (1, 2, 1),
+        )
+
+    def test_memory_layer_is_bounded_and_expires(self):
+        cache = self.make_cache(L1_MAX_ENTRIES=2)
+        cache.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(cache.stats()['l1_size'], 2)
+        cache = self.make_cache(L1_TIMEOUT=0)
+        cache.set('a', 1)
+        caches['default'].set('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+
+    def test_writes_drop_local_copy(self):
+        self.cache.set('counter', 1)
+        self.assertEqual(self.cache.incr('counter'), 2)
+        self.assertEqual(self.cache.get('counter'), 2)
+        self.cache.delete('counter')
+        self.assertIsNone(caches['default'].get('counter'))
+        self.assertIsNone(self.cache.get('counter'))
+
+
+@override_settings(SERVER_TIMING_SAMPLE_RATE=1, SERVER_TIMING_HEADER=True)
+class ServerTimingMiddlewareTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author')
+        Post.objects.create(text='Пост', author=author)
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+
+    def setUp(self):
+        caches['posts'].clear()
+        self.client.force_login(self.staff)
+
+    def timings(self, response):
+        entries = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            entries[name] = dict(param.split('=', 1) for param in params)
+        return entries
+
+    def test_header_and_log_line(self):
+        with self.assertLogs('core.middleware', 'INFO') as logs:
+            response = self.client.get(reverse('posts:index'))
+        timings = self.timings(response)
+        self.assertEqual(
+            set(timings), {'db', 'template', 'cache', 'thumbnails', 'total'})
+        self.assertNotEqual(timings['db']['desc'], '"0 queries"')
+        self.assertGreater(float(timings['template']['dur']), 0)
+        self.assertIn('hit=0', timings['cache']['desc'])
+        metrics = logs.records[0].metrics
+        self.assertGreater(metrics['queries'], 0)
+        self.assertGreater(metrics['cache_misses'], 0)
+        self.assertIn('path=/ status=200', logs.output[0])
+
+        # Повторный запрос отдаётся из кэша страниц: SQL остаётся только
+        # на сессию и пользователя.
+        response = self.client.get(reverse('posts:index'))
+        self.assertEqual(self.timings(response)['db']['desc'],
+                         '"2 queries"')
+        self.assertNotIn('hit=0', self.timings(response)['cache']['desc'])
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_instrumented(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_can_be_disabled(self):
+        with self.assertLogs('core.middleware', 'INFO'):
+            response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_header_is_only_for_staff(self):
+        self.client.logout()
+        with self.assertLogs('core.middleware', 'INFO'):
+            response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+@query_budget(1)
+def two_queries(request):
+    list(User.objects.all())
+    list(Post.objects.all())
+    return HttpResponse()
+
+
+@query_budget(0)
+def lazy_template(request):
+    template = engines.all()[0].from_string(
+        '{% for post in posts %}{{ post }}{% endfor %}')
+    return SimpleTemplateResponse(template, {'posts': Post.objects.all()})
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTest(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+
+    def test_budget_is_exposed(self):
+        self.assertEqual(two_queries.query_budget, 1)
+
+    def test_overrun_raises_with_origin(self):
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            two_queries(self.request)
+        message = str(raised.exception)
+        self.assertIn('2 SQL-запросов при бюджете 1', message)
+        self.assertIn('posts_post', message)
+        self.assertIn(os.path.join('core', 'tests.py'), message)
+        self.assertIn('in two_queries', message)
+
+    def test_template_queries_are_counted(self):
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            lazy_template(self.request)
+        self.assertIn('{% for post in posts %}', str(raised.exception))
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_overrun_is_logged_outside_tests(self):
+        with self.assertLogs('core.decorators', 'WARNING') as logs:
+            response = two_queries(self.request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('in two_queries', logs.output[0])
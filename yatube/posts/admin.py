@@ -2,6 +2,7 @@ from django.contrib import admin
 
 # Register your models here.
 from .models import Group, Post, Comment, Follow
+from .search import search_posts
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -17,6 +18,12 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Ищем по полнотекстовому индексу, а не LIKE по всей таблице.
+        if not search_term.strip():
+            return queryset, False
+        return search_posts(queryset, search_term), False
+
 
 class CommentAdmin(admin.ModelAdmin):
     list_display = (
@@ -0,0 +1,74 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.decorators import cache_page_swr
+
+VERSION_KEY = 'feed:version:{}'
+PAGE_KEY = '{path}:{user}'
+
+GLOBAL = 'global'
+
+
+def group_scope(slug):
+    return 'group:{}'.format(slug)
+
+
+def author_scope(username):
+    return 'author:{}'.format(username)
+
+
+def _initial_version():
+    # Если ключ версии вытеснен из кэша, новая версия не совпадёт ни с одной
+    # из прежних, и старые страницы не всплывут.
+    return int(time.time() * 1000)
+
+
+def get_versions(scopes):
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            initial = _initial_version()
+            if not cache.add(key, initial, None):
+                initial = cache.get(key, initial)
+            versions[key] = initial
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    """Инвалидирует все закэшированные страницы указанных областей."""
+    for scope in set(scopes):
+        key = VERSION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), None)
+
+
+def cache_feed(scopes):
+    """Кэширует страницу ленты, сверяя её с версиями её областей.
+
+    scopes(request, *args, **kwargs) возвращает список областей страницы
+    (GLOBAL, group_scope(...), author_scope(...)). Запись в любой из них
+    меняет версию, поэтому страницу можно хранить долго: после изменения
+    она пересоберётся на первом же запросе. Кнопки редактирования и
+    подписки зависят от зрителя, так что ключ включает id пользователя.
+    """
+    def key(request, *args, **kwargs):
+        return PAGE_KEY.format(
+            path=hashlib.md5(request.get_full_path().encode()).hexdigest(),
+            user=request.user.pk or 0,
+        )
+
+    def version(request, *args, **kwargs):
+        versions = get_versions(scopes(request, *args, **kwargs))
+        return '.'.join(str(version) for version in versions)
+
+    return cache_page_swr(
+        key, version,
+        timeout=settings.FEED_CACHE_TIMEOUT,
+        stale_timeout=settings.FEED_CACHE_STALE_TIMEOUT,
+    )
@@ -0,0 +1,36 @@
+from django.core.checks import Error, Tags, register
+from django.db import connection
+
+from .search import FTS_TABLE, FTS_TRIGGERS, fts_available
+
+
+@register(Tags.database)
+def check_fts_triggers(app_configs, **kwargs):
+    """Триггеры полнотекстового индекса на месте.
+
+    SQLite пересоздаёт таблицу при многих изменениях схемы и теряет её
+    триггеры без всякой ошибки, после чего поиск молча отстаёт от постов.
+    Проверка с тегом database выполняется перед каждым migrate.
+    """
+    if not fts_available():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')"
+            " AND name IN ({})".format(
+                ', '.join(['%s'] * (len(FTS_TRIGGERS) + 1))),
+            [FTS_TABLE, *FTS_TRIGGERS])
+        names = {name for name, in cursor.fetchall()}
+    if FTS_TABLE not in names:
+        # Миграция 0014_post_fts ещё не применена.
+        return []
+    missing = [name for name in FTS_TRIGGERS if name not in names]
+    if not missing:
+        return []
+    return [Error(
+        'Нет триггеров полнотекстового поиска: {}.'.format(', '.join(missing)),
+        hint='Скорее всего, миграция пересоздала таблицу posts_post. '
+             'Пересоздайте индекс: python manage.py migrate posts 0013 '
+             '&& python manage.py migrate posts',
+        id='posts.E001',
+    )]
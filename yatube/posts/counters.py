@@ -0,0 +1,54 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Follow, Post, UserStats
+
+
+def count_user_stats(user_id):
+    return {
+        'posts_count': Post.objects.filter(author_id=user_id).count(),
+        'followers_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def get_user_stats(user_id):
+    """Счётчики пользователя; при отсутствии строки она создаётся
+    по фактическим данным.
+    """
+    stats = UserStats.objects.filter(user_id=user_id).first()
+    if stats is None:
+        stats, _ = UserStats.objects.get_or_create(
+            user_id=user_id, defaults=count_user_stats(user_id))
+    return stats
+
+
+def _delta(field, delta):
+    if delta < 0:
+        return Greatest(F(field) + delta, 0)
+    return F(field) + delta
+
+
+def change_user_stats(user_id, field, delta):
+    if UserStats.objects.filter(user_id=user_id).update(
+            **{field: _delta(field, delta)}) or delta < 0:
+        # При удалении строку не создаём: пользователь может удаляться
+        # каскадом в этой же транзакции.
+        return
+    # Строки ещё нет: создаём её по фактическим данным, которые уже
+    # учитывают текущее изменение.
+    try:
+        with transaction.atomic():
+            UserStats.objects.create(
+                user_id=user_id, **count_user_stats(user_id))
+    except IntegrityError:
+        UserStats.objects.filter(user_id=user_id).update(
+            **{field: _delta(field, delta)})
+
+
+def change_comments_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=_delta('comments_count', delta),
+        modified=timezone.now())
@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.db import transaction
+
+from core import tasks
+
+from .models import FeedEntry, Follow, Post, UserStats
+
+
+def _entries(post, user_ids):
+    return [
+        FeedEntry(user_id=user_id, post_id=post.pk,
+                  author_id=post.author_id, pub_date=post.pub_date)
+        for user_id in user_ids
+    ]
+
+
+def is_popular(author_id):
+    """Посты популярных авторов не раскладываются по лентам: лента
+    подписчика берёт их из таблицы постов при чтении.
+    """
+    return UserStats.objects.filter(
+        user_id=author_id,
+        followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).exists()
+
+
+def get_popular_following(user_id):
+    """id популярных авторов среди подписок пользователя."""
+    return list(
+        Follow.objects.filter(
+            user_id=user_id,
+            author__stats__followers_count__gt=(
+                settings.FEED_FANOUT_MAX_FOLLOWERS),
+        ).values_list('author_id', flat=True)
+    )
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора.
+
+    Небольшие рассылки пишутся сразу, большие уходят в фоновую задачу,
+    которая пишет ленты пачками по FEED_FANOUT_BATCH_SIZE. Популярных
+    авторов (больше FEED_FANOUT_MAX_FOLLOWERS подписчиков) задача
+    пропускает: их посты лента читает сама.
+    """
+    limit = settings.FEED_FANOUT_INLINE_LIMIT
+    followers = list(
+        Follow.objects.filter(author_id=post.author_id)
+        .values_list('user_id', flat=True)[:limit + 1]
+    )
+    if len(followers) <= limit:
+        FeedEntry.objects.bulk_create(
+            _entries(post, followers), ignore_conflicts=True)
+        return
+    tasks.submit(fan_out_post_in_batches, post.pk)
+
+
+def fan_out_post_in_batches(post_id):
+    post = Post.objects.filter(pk=post_id).only(
+        'pk', 'author_id', 'pub_date').first()
+    if post is None or is_popular(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id).order_by('user_id')
+    last_user_id = 0
+    while True:
+        batch = list(
+            followers.filter(user_id__gt=last_user_id)
+            .values_list('user_id', flat=True)
+            [:settings.FEED_FANOUT_BATCH_SIZE]
+        )
+        if not batch:
+            return
+        with transaction.atomic():
+            FeedEntry.objects.bulk_create(
+                _entries(post, batch), ignore_conflicts=True)
+        last_user_id = batch[-1]
+
+
+def backfill_feed(user_id, author_id):
+    """Добавляет в ленту подписчика последние посты нового автора."""
+    if is_popular(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date').only('pk', 'author_id', 'pub_date')[
+            :settings.FEED_BACKFILL_SIZE]
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(user_id=user_id, post_id=post.pk,
+                      author_id=author_id, pub_date=post.pub_date)
+            for post in posts
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def prune_feed(user_id, author_id):
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
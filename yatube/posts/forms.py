@@ -1,5 +1,9 @@
 from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
 
+from .images import describe_image, normalize_image
 from .models import Post, Comment
 
 
@@ -18,6 +22,34 @@ class PostForm(forms.ModelForm):
         'group': 'Группа, к которой будет относится пост'
     }
 
+    def __init__(self, *args, upload_too_large=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_too_large = upload_too_large
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.upload_too_large:
+            self.add_error('image', 'Файл больше {} МБ.'.format(
+                settings.POST_UPLOAD_MAX_BYTES // (1024 * 1024)))
+        return cleaned_data
+
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # При редактировании без новой картинки здесь уже сохранённый файл.
+        if isinstance(image, UploadedFile):
+            # Размеры берутся из заголовка, пиксели ещё не декодированы.
+            width, height = Image.open(image).size
+            if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+                raise forms.ValidationError(
+                    'Слишком большое разрешение картинки.')
+            image = normalize_image(image)
+            (self.instance.image_placeholder, self.instance.image_width,
+             self.instance.image_height) = describe_image(image)
+        elif not image:
+            self.instance.image_placeholder = ''
+            self.instance.image_width = self.instance.image_height = None
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
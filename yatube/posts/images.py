@@ -0,0 +1,106 @@
+import base64
+import io
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image, ImageOps
+
+# Метаданные, которые не переживают нормализацию (ICC-профиль оставляем,
+# иначе поплывут цвета).
+METADATA_KEYS = {'exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop'}
+LOSSY_FORMATS = {'JPEG', 'WEBP'}
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+
+
+def _needs_normalizing(image, size):
+    return (
+        max(image.size) > settings.IMAGE_UPLOAD_MAX_DIMENSION
+        or size > settings.IMAGE_UPLOAD_MAX_BYTES
+        or bool(METADATA_KEYS & image.info.keys())
+    )
+
+
+def _encode(image, image_format, name, quality, icc_profile):
+    """Кодирует картинку сразу во временный файл на диске."""
+    root, _ = os.path.splitext(os.path.basename(name))
+    output = TemporaryUploadedFile(
+        root + EXTENSIONS.get(image_format, ''),
+        Image.MIME.get(image_format, 'application/octet-stream'), 0, None)
+    options = {'optimize': True}
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    if image_format in LOSSY_FORMATS:
+        options['quality'] = quality
+    if image_format == 'JPEG':
+        options['progressive'] = True
+    image.save(output.file, format=image_format, **options)
+    output.size = output.file.tell()
+    output.seek(0)
+    return output
+
+
+def normalize_image(uploaded):
+    """Приводит загруженную картинку к ограничениям IMAGE_UPLOAD_*.
+
+    Картинка уменьшается до IMAGE_UPLOAD_MAX_DIMENSION по большей стороне,
+    поворачивается по EXIF, теряет метаданные и перекодируется с качеством
+    IMAGE_UPLOAD_QUALITY, которое снижается до IMAGE_UPLOAD_MIN_QUALITY,
+    пока файл не влезет в IMAGE_UPLOAD_MAX_BYTES. JPEG декодируется сразу
+    в уменьшенном масштабе (draft), а результат пишется во временный файл,
+    так что исходник целиком в память не попадает. Картинки, которые уже
+    укладываются в ограничения, возвращаются как есть.
+    """
+    max_bytes = settings.IMAGE_UPLOAD_MAX_BYTES
+    max_dimension = settings.IMAGE_UPLOAD_MAX_DIMENSION
+    uploaded.seek(0)
+    image = Image.open(uploaded)
+    image_format = image.format
+    if getattr(image, 'is_animated', False) or not _needs_normalizing(
+            image, uploaded.size):
+        # Анимацию при перекодировании потеряли бы — только проверяем размер.
+        if uploaded.size > max_bytes:
+            raise ValidationError('Файл картинки слишком большой.')
+        uploaded.seek(0)
+        return uploaded
+    icc_profile = image.info.get('icc_profile')
+    image.draft('RGB', (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_dimension, max_dimension))
+    # exif_transpose и thumbnail сохраняют info исходника, а кодировщики
+    # PNG и GIF берут метаданные оттуда: убираем их до перекодирования.
+    for key in METADATA_KEYS:
+        image.info.pop(key, None)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    quality = settings.IMAGE_UPLOAD_QUALITY
+    while True:
+        output = _encode(
+            image, image_format, uploaded.name, quality, icc_profile)
+        if output.size <= max_bytes:
+            return output
+        output.close()
+        quality -= 10
+        if (image_format not in LOSSY_FORMATS
+                or quality < settings.IMAGE_UPLOAD_MIN_QUALITY):
+            raise ValidationError('Файл картинки слишком большой.')
+
+
+def describe_image(uploaded):
+    """Размеры картинки и крошечная JPEG-копия в пропорциях карточки
+    в виде data URI — заглушка, пока грузится настоящая картинка.
+    """
+    uploaded.seek(0)
+    image = Image.open(uploaded)
+    width, height = image.size
+    aspect_width, aspect_height = settings.IMAGE_VARIANT_ASPECT
+    size = (settings.IMAGE_PLACEHOLDER_WIDTH, max(1, round(
+        settings.IMAGE_PLACEHOLDER_WIDTH * aspect_height / aspect_width)))
+    image.draft('RGB', size)
+    placeholder = ImageOps.fit(image.convert('RGB'), size)
+    buffer = io.BytesIO()
+    placeholder.save(buffer, 'JPEG', quality=40, optimize=True)
+    uploaded.seek(0)
+    data = base64.b64encode(buffer.getvalue()).decode()
+    return 'data:image/jpeg;base64,' + data, width, height
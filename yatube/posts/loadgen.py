@@ -0,0 +1,178 @@
+"""Клиентская часть нагрузочного теста (manage.py loadtest).
+
+Модуль не импортирует Django: процессы-клиенты запускаются через spawn
+и ходят на сервер только по HTTP.
+"""
+import io
+import math
+import random
+import time
+
+import requests
+from PIL import Image
+
+LOGIN_URL = '/auth/login/'
+# Границы корзин гистограммы задержек, мс.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+DEFAULT_MIX = 'index=60,follow_index=25,add_comment=10,post_create=5'
+TIMEOUT = 30
+
+
+def parse_mix(value):
+    """'index=60,follow_index=25' -> [('index', 60), ('follow_index', 25)]."""
+    mix = []
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in ACTIONS:
+            raise ValueError(f'Неизвестный сценарий: {name}')
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def csrf_token(session, base_url):
+    if 'csrftoken' not in session.cookies:
+        session.get(base_url + LOGIN_URL, timeout=TIMEOUT)
+    return session.cookies.get('csrftoken', '')
+
+
+def login(session, base_url, username, password):
+    response = session.post(base_url + LOGIN_URL, data={
+        'username': username,
+        'password': password,
+        'csrfmiddlewaretoken': csrf_token(session, base_url),
+    }, allow_redirects=False, timeout=TIMEOUT)
+    if response.status_code != 302:
+        raise RuntimeError(f'Не удалось войти как {username}')
+
+
+def make_image(rng):
+    buffer = io.BytesIO()
+    color = tuple(rng.randrange(256) for _ in range(3))
+    Image.new('RGB', (640, 480), color).save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def browse_index(client):
+    page = client.rng.randint(1, client.pages)
+    return client.anonymous.get(
+        client.base_url + f'/?page={page}', timeout=TIMEOUT)
+
+
+def read_follow_index(client):
+    return client.member.get(client.base_url + '/follow/', timeout=TIMEOUT)
+
+
+def add_comment(client):
+    post_id = client.rng.choice(client.post_ids)
+    return client.member.post(
+        client.base_url + f'/posts/{post_id}/comment/',
+        data={'text': 'Нагрузочный комментарий',
+              'csrfmiddlewaretoken': client.token},
+        allow_redirects=False, timeout=TIMEOUT)
+
+
+def create_post(client):
+    return client.member.post(
+        client.base_url + '/create/',
+        data={'text': 'Нагрузочный пост',
+              'csrfmiddlewaretoken': client.token},
+        files={'image': ('load.jpg', client.image, 'image/jpeg')},
+        allow_redirects=False, timeout=TIMEOUT)
+
+
+ACTIONS = {
+    'index': browse_index,
+    'follow_index': read_follow_index,
+    'add_comment': add_comment,
+    'post_create': create_post,
+}
+
+
+class LoadClient:
+    """Один процесс-клиент: анонимная сессия для ленты и сессия
+    пользователя для остальных сценариев.
+    """
+
+    def __init__(self, base_url, credentials, post_ids, pages, seed):
+        self.base_url = base_url
+        self.rng = random.Random(seed)
+        self.post_ids = post_ids
+        self.pages = max(1, pages)
+        self.anonymous = requests.Session()
+        self.member = requests.Session()
+        login(self.member, base_url, *credentials)
+        self.token = csrf_token(self.member, base_url)
+        self.image = make_image(self.rng)
+
+    def run(self, mix, duration):
+        """Выполняет сценарии, пока не истечёт duration секунд;
+        возвращает [(сценарий, задержка в секундах, ошибка или None)].
+        """
+        names = [name for name, _ in mix]
+        weights = [weight for _, weight in mix]
+        results = []
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            name = self.rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = ACTIONS[name](self)
+                error = (f'HTTP {response.status_code}'
+                         if response.status_code >= 400 else None)
+            except requests.RequestException as exc:
+                error = type(exc).__name__
+            results.append((name, time.perf_counter() - started, error))
+        return results
+
+
+def run_client(base_url, credentials, post_ids, pages, seed, mix,
+               duration):
+    """Точка входа процесса пула."""
+    client = LoadClient(base_url, credentials, post_ids, pages, seed)
+    return client.run(mix, duration)
+
+
+def histogram(latencies):
+    """Число запросов по корзинам BUCKETS: [(граница в мс или None, n)]."""
+    counts = [0] * (len(BUCKETS) + 1)
+    for latency in latencies:
+        milliseconds = latency * 1000
+        index = next((index for index, bound in enumerate(BUCKETS)
+                      if milliseconds < bound), len(BUCKETS))
+        counts[index] += 1
+    return list(zip(BUCKETS + (None,), counts))
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarize(results, elapsed):
+    """Пропускная способность, перцентили, гистограмма и доля ошибок
+    по каждому сценарию и по всем вместе.
+    """
+    if not results:
+        return {}
+    groups = {'all': results}
+    for result in results:
+        groups.setdefault(result[0], []).append(result)
+    report = {}
+    for name, items in groups.items():
+        latencies = [latency for _, latency, _ in items]
+        errors = {}
+        for _, _, error in items:
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+        report[name] = {
+            'requests': len(items),
+            'rps': round(len(items) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'error_rate': round(sum(errors.values()) / len(items), 4),
+            'errors': errors,
+            'histogram': histogram(latencies),
+        }
+    return report
@@ -0,0 +1,193 @@
+import copy
+import io
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from posts.loadgen import percentile
+from posts.models import Group, Post, User
+
+PERCENTILES = (50, 95, 99)
+
+
+def summarize(timings, queries, sizes):
+    result = {
+        f'p{percent}_ms': round(percentile(timings, percent) * 1000, 3)
+        for percent in PERCENTILES
+    }
+    result['mean_ms'] = round(sum(timings) / len(timings) * 1000, 3)
+    result['queries'] = max(queries)
+    result['bytes'] = max(sizes)
+    return result
+
+
+def find_regressions(results, baseline, threshold):
+    """Адреса, где p95 вырос больше чем на threshold или стало больше
+    запросов, чем в baseline.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(
+                f'{name}: p95 {previous["p95_ms"]} -> {current["p95_ms"]} мс')
+        if current['queries'] > previous['queries']:
+            regressions.append(
+                f'{name}: запросов {previous["queries"]} -> '
+                f'{current["queries"]}')
+    return regressions
+
+
+def seed(options):
+    """Заполняет пустую базу командой seed с размерами из options."""
+    call_command(
+        'seed', stdout=io.StringIO(), **{
+            key: options[key] for key in (
+                'seed', 'users', 'groups', 'posts', 'comments', 'follows')
+        })
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время ответа, число запросов и размер страниц '
+            'posts: в процессе, через тестовый клиент Django, на отдельной '
+            'тестовой базе со сгенерированными данными.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument(
+            '--follows', type=float, default=20,
+            help='Среднее число подписок пользователя.')
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэши перед каждым запросом.')
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help='Мерить на текущей базе, не создавая тестовую '
+                 'и не заполняя её.')
+        parser.add_argument('--output', help='Куда записать JSON.')
+        parser.add_argument(
+            '--baseline', help='JSON прошлого запуска для сравнения.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.1,
+            help='Допустимый рост p95 относительно baseline, доля.')
+
+    def handle(self, *args, **options):
+        if options['current_db']:
+            results = self.run(options)
+        else:
+            results = self.run_isolated(options)
+        report = {
+            'config': {
+                key: options[key] for key in (
+                    'iterations', 'warmup', 'seed', 'users', 'groups',
+                    'posts', 'comments', 'follows', 'cold', 'current_db')
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = find_regressions(
+                    results, json.load(baseline)['results'],
+                    options['threshold'])
+            if regressions:
+                raise CommandError(
+                    'Регрессия производительности:\n'
+                    + '\n'.join(regressions))
+
+    def run_isolated(self, options):
+        """Замер на тестовой базе и с кэшем default во временном каталоге,
+        чтобы не отдавать страницы, закэшированные с рабочей базы.
+        """
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_settings = copy.deepcopy(settings.CACHES)
+            cache_settings['default']['LOCATION'] = os.path.join(
+                cache_dir, 'default.sqlite3')
+            with override_settings(CACHES=cache_settings):
+                old_name = connection.creation.create_test_db(
+                    verbosity=0, autoclobber=True, serialize=False)
+                try:
+                    seed(options)
+                    return self.run(options)
+                finally:
+                    connection.creation.destroy_test_db(
+                        old_name, verbosity=0)
+
+    def targets(self):
+        """Адреса для замера: самые «тяжёлые» группа, автор, пост
+        и читатель ленты подписок.
+        """
+        author = User.objects.annotate(
+            total=Count('posts')).order_by('-total', 'pk').first()
+        reader = User.objects.annotate(
+            total=Count('follower')).order_by('-total', 'pk').first()
+        group = Group.objects.annotate(
+            total=Count('posts')).order_by('-total', 'pk').first()
+        post = Post.objects.order_by('-comments_count', 'pk').first()
+        if None in (author, reader, group, post):
+            raise CommandError('В базе нет данных для замера.')
+        anonymous = Client()
+        member = Client()
+        member.force_login(reader)
+        word = post.text.split()[0] if post.text.split() else post.text
+        return [
+            ('index', anonymous, reverse('posts:index')),
+            ('index_page_2', anonymous, reverse('posts:index') + '?page=2'),
+            ('group_list', anonymous,
+             reverse('posts:group_list', args=[group.slug])),
+            ('profile', anonymous,
+             reverse('posts:profile', args=[author.username])),
+            ('post_detail', anonymous,
+             reverse('posts:post_detail', args=[post.pk])),
+            ('follow_index', member, reverse('posts:follow_index')),
+            ('search', anonymous, reverse('posts:search') + '?q=' + word),
+        ]
+
+    def run(self, options):
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for name, client, url in self.targets():
+                results[name] = self.measure(client, url, options)
+                self.stdout.write('{:<14} p50={p50_ms}ms p95={p95_ms}ms '
+                                  'p99={p99_ms}ms queries={queries} '
+                                  'bytes={bytes}'.format(name,
+                                                         **results[name]))
+        return results
+
+    def measure(self, client, url, options):
+        for _ in range(options['warmup']):
+            client.get(url)
+        timings, queries, sizes = [], [], []
+        for _ in range(options['iterations']):
+            if options['cold']:
+                caches['posts'].clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: ответ {response.status_code}')
+            queries.append(len(captured.captured_queries))
+            sizes.append(len(response.content))
+        return summarize(timings, queries, sizes)
@@ -0,0 +1,143 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from posts.models import ImageBlob, Post
+from posts.storage import image_storage
+
+
+def walk_sorted(root, prefix):
+    """Файлы каталога MEDIA_ROOT/prefix в порядке сравнения строк путей.
+
+    Каталоги читаются по одному; каталог сортируется как «имя/», чтобы
+    «ab.png» шёл раньше «ab/...», как в ORDER BY по столбцу.
+    Отдаёт (имя относительно MEDIA_ROOT, размер, mtime).
+    """
+    path = os.path.join(root, prefix)
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda entry: entry.name + (
+        '/' if entry.is_dir(follow_symlinks=False) else ''))
+    for entry in entries:
+        name = prefix + '/' + entry.name if prefix else entry.name
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_sorted(root, name)
+        elif entry.is_file(follow_symlinks=False):
+            stat = entry.stat()
+            yield name, stat.st_size, stat.st_mtime
+
+
+def unreferenced(files, referenced):
+    """Слияние двух отсортированных потоков: файлы, которых нет среди
+    имён referenced (имена там могут повторяться).
+    """
+    referenced = iter(referenced)
+    current = next(referenced, None)
+    for file_ in files:
+        while current is not None and current < file_[0]:
+            current = next(referenced, None)
+        if current != file_[0]:
+            yield file_
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки постов, на которые не ссылается ни один пост, '
+            'и превью sorl-thumbnail, о которых не знает его хранилище.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд: их пост может '
+                 'быть ещё не сохранён.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать файлы и байты, которые будут удалены.')
+
+    def handle(self, *args, batch_size, min_age, dry_run, **options):
+        self.dry_run = dry_run
+        self.deadline = time.time() - min_age
+        originals = self.collect_originals(batch_size)
+        thumbnails = self.collect_thumbnails(batch_size)
+        files = originals[0] + thumbnails[0]
+        size = originals[1] + thumbnails[1]
+        verb = 'Будет удалено' if dry_run else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} файлов: {files} (картинок {originals[0]}, '
+            f'превью {thumbnails[0]}), освобождено байт: {size}'))
+
+    def old_enough(self, files):
+        return (file_ for file_ in files if file_[2] < self.deadline)
+
+    def collect_originals(self, batch_size):
+        upload_to = Post._meta.get_field('image').upload_to.rstrip('/')
+        referenced = Post.objects.filter(
+            image__startswith=upload_to + '/').order_by('image').values_list(
+                'image', flat=True).iterator(chunk_size=batch_size)
+        files = self.old_enough(
+            walk_sorted(settings.MEDIA_ROOT, upload_to))
+        count = size = 0
+        for batch in batches(unreferenced(files, referenced), batch_size):
+            for name, file_size, _ in batch:
+                size += file_size + self.delete_original(name)
+            count += len(batch)
+            if not self.dry_run:
+                ImageBlob.objects.filter(
+                    name__in=[name for name, _, _ in batch]).delete()
+        return count, size
+
+    def delete_original(self, name):
+        """Удаляет картинку с её превью; возвращает размер превью."""
+        image_file = ImageFile(name, image_storage)
+        kvstore = default.kvstore
+        thumbnails = [
+            kvstore._get(key) for key in
+            kvstore._get(image_file.key, identity='thumbnails') or []
+        ]
+        size = sum(thumbnail.storage.size(thumbnail.name)
+                   for thumbnail in thumbnails
+                   if thumbnail and thumbnail.exists())
+        if not self.dry_run:
+            kvstore.delete(image_file)
+            image_storage.delete(name)
+        return size
+
+    def collect_thumbnails(self, batch_size):
+        files = self.old_enough(walk_sorted(
+            settings.MEDIA_ROOT, sorl_settings.THUMBNAIL_PREFIX.rstrip('/')))
+        count = size = 0
+        for batch in batches(files, batch_size):
+            keys = {
+                add_prefix(ImageFile(name, default.storage).key): name
+                for name, _, _ in batch
+            }
+            known = set(KVStoreModel.objects.filter(
+                key__in=list(keys)).values_list('key', flat=True))
+            for key, name in keys.items():
+                if key in known:
+                    continue
+                count += 1
+                size += default.storage.size(name)
+                if not self.dry_run:
+                    default.storage.delete(name)
+        return count, size
@@ -0,0 +1,183 @@
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import got_request_exception
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from posts.loadgen import (
+    BUCKETS, DEFAULT_MIX, parse_mix, run_client, summarize)
+from posts.management.commands.bench import seed
+from posts.models import Post, User
+from yatube.wsgi import application
+
+PASSWORD = 'loadtest-password'
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ServerErrors:
+    """Исключения, которые Django поймал при обработке запросов."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def __call__(self, sender, request=None, **kwargs):
+        exception = sys.exc_info()[1]
+        if isinstance(exception, OperationalError) and (
+                'database is locked' in str(exception)):
+            key = 'database is locked'
+        else:
+            key = type(exception).__name__
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест: запускает yatube.wsgi.application '
+            'в многопоточном WSGI-сервере на тестовой базе и нагружает его '
+            'смесью запросов из пула процессов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=30)
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 2,
+            help='Число процессов-клиентов, каждый — отдельный '
+                 'пользователь.')
+        parser.add_argument(
+            '--mix', default=DEFAULT_MIX,
+            help='Веса сценариев index, follow_index, add_comment, '
+                 'post_create.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--groups', type=int, default=5)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--comments', type=int, default=2000)
+        parser.add_argument('--follows', type=float, default=10)
+        parser.add_argument('--output', help='Куда записать JSON.')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as exc:
+            raise CommandError(exc)
+        with tempfile.TemporaryDirectory() as workdir:
+            # Сервер и клиенты работают с настоящим файлом SQLite, как
+            # в бою: только так видны блокировки при конкурентной записи.
+            cache_settings = copy.deepcopy(settings.CACHES)
+            cache_settings['default']['LOCATION'] = os.path.join(
+                workdir, 'cache.sqlite3')
+            test_settings = connection.settings_dict['TEST']
+            test_name = test_settings.get('NAME')
+            test_settings['NAME'] = os.path.join(workdir, 'db.sqlite3')
+            with override_settings(
+                    CACHES=cache_settings,
+                    MEDIA_ROOT=os.path.join(workdir, 'media'),
+                    ALLOWED_HOSTS=['127.0.0.1']):
+                old_name = connection.creation.create_test_db(
+                    verbosity=0, autoclobber=True, serialize=False)
+                try:
+                    report = self.run(mix, options)
+                finally:
+                    connection.creation.destroy_test_db(
+                        old_name, verbosity=0)
+                    test_settings['NAME'] = test_name
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+
+    def prepare(self, options):
+        seed(options)
+        # Один хэш на всех: PBKDF2 для каждого пользователя занял бы
+        # больше времени, чем сама подготовка данных.
+        User.objects.update(password=make_password(PASSWORD))
+        usernames = list(User.objects.order_by('pk').values_list(
+            'username', flat=True))
+        post_ids = list(Post.objects.values_list('pk', flat=True))
+        pages = len(post_ids) // 10 + 1
+        connection.close()
+        return usernames, post_ids, pages
+
+    def run(self, mix, options):
+        usernames, post_ids, pages = self.prepare(options)
+        errors = ServerErrors()
+        got_request_exception.connect(errors, weak=False)
+        # Ошибки считает ServerErrors, трейсбэк каждой только зашумит вывод.
+        request_logger = logging.getLogger('django.request')
+        request_logger.disabled = True
+        server = make_server('127.0.0.1', 0, application,
+                             server_class=ThreadingWSGIServer,
+                             handler_class=QuietHandler)
+        base_url = 'http://127.0.0.1:%d' % server.server_port
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        processes = options['processes']
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=multiprocessing.get_context('spawn')) as pool:
+                started = time.monotonic()
+                futures = [
+                    pool.submit(
+                        run_client, base_url,
+                        (usernames[index % len(usernames)], PASSWORD),
+                        post_ids, pages, options['seed'] + index, mix,
+                        options['duration'])
+                    for index in range(processes)
+                ]
+                results = [result for future in futures
+                           for result in future.result()]
+                elapsed = time.monotonic() - started
+        finally:
+            server.shutdown()
+            server.server_close()
+            got_request_exception.disconnect(errors)
+            request_logger.disabled = False
+        return {
+            'config': {key: options[key] for key in (
+                'duration', 'processes', 'mix', 'seed', 'users', 'posts')},
+            'elapsed': round(elapsed, 2),
+            'results': summarize(results, elapsed),
+            'server_errors': errors.counts,
+        }
+
+    def print_report(self, report):
+        results = report['results']
+        for name, result in results.items():
+            self.stdout.write(
+                '{:<13} n={requests} rps={rps} p50={p50_ms}ms '
+                'p95={p95_ms}ms p99={p99_ms}ms errors={error_rate:.2%}'
+                .format(name, **result))
+        if 'all' in results:
+            histogram = results['all']['histogram']
+            widest = max(count for _, count in histogram) or 1
+            self.stdout.write('Задержки, все сценарии:')
+            for bound, count in histogram:
+                label = f'< {bound} мс' if bound else f'>= {BUCKETS[-1]} мс'
+                self.stdout.write('{:>11} {:<40} {}'.format(
+                    label, '#' * round(40 * count / widest), count))
+        for error, count in report['server_errors'].items():
+            self.stdout.write(self.style.ERROR(
+                f'Ошибка сервера «{error}»: {count}'))
@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from posts import caching
+from posts.models import Comment, Follow, Post, User, UserStats
+from posts.signals import post_scopes
+
+STAT_FIELDS = ('posts_count', 'followers_count', 'following_count')
+
+
+def _count_subquery(queryset, field):
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+        field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def _batches(queryset, batch_size):
+    """Разбивает таблицу на пачки по первичному ключу без OFFSET."""
+    last_pk = 0
+    while True:
+        pks = list(queryset.filter(pk__gt=last_pk).order_by('pk')
+                   .values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает денормализованные счётчики постов, '
+            'комментариев и подписок и исправляет расхождения. '
+            'Закэшированные карточки и страницы с исправленными '
+            'счётчиками сбрасываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, сколько строк разошлось.')
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        users = self.recount_users(batch_size, dry_run)
+        posts = self.recount_posts(batch_size, dry_run)
+        verb = 'Найдено' if dry_run else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} расхождений: пользователи — {users}, посты — {posts}'))
+
+    def recount_users(self, batch_size, dry_run):
+        fixed = 0
+        for pks in _batches(User.objects.all(), batch_size):
+            actual = User.objects.filter(pk__in=pks).annotate(
+                posts_count=_count_subquery(Post.objects.all(), 'author'),
+                followers_count=_count_subquery(
+                    Follow.objects.all(), 'author'),
+                following_count=_count_subquery(Follow.objects.all(), 'user'),
+            ).values_list('pk', 'username', *STAT_FIELDS)
+            stored = UserStats.objects.in_bulk(pks)
+            to_create, to_update, usernames = [], [], []
+            for pk, username, *values in actual:
+                counts = dict(zip(STAT_FIELDS, values))
+                stats = stored.get(pk)
+                if stats is None:
+                    to_create.append(UserStats(user_id=pk, **counts))
+                elif any(getattr(stats, field) != value
+                         for field, value in counts.items()):
+                    for field, value in counts.items():
+                        setattr(stats, field, value)
+                    to_update.append(stats)
+                else:
+                    continue
+                usernames.append(username)
+            fixed += len(usernames)
+            if not dry_run and usernames:
+                with transaction.atomic():
+                    UserStats.objects.bulk_create(
+                        to_create, ignore_conflicts=True)
+                    UserStats.objects.bulk_update(to_update, STAT_FIELDS)
+                # Счётчики подписок выводятся в профиле.
+                caching.bump(*(caching.author_scope(username)
+                               for username in usernames))
+        return fixed
+
+    def recount_posts(self, batch_size, dry_run):
+        fixed = 0
+        for pks in _batches(Post.objects.all(), batch_size):
+            drifted = []
+            actual = Post.objects.filter(pk__in=pks).annotate(
+                actual=_count_subquery(Comment.objects.all(), 'post'),
+            ).select_related('author', 'group').only(
+                'pk', 'comments_count', 'author__username', 'group__slug')
+            now = timezone.now()
+            for post in actual:
+                if post.comments_count != post.actual:
+                    post.comments_count = post.actual
+                    # modified входит в ключ кэша карточки поста.
+                    post.modified = now
+                    drifted.append(post)
+            fixed += len(drifted)
+            if not dry_run and drifted:
+                Post.objects.bulk_update(
+                    drifted, ['comments_count', 'modified'])
+                caching.bump(*(scope for post in drifted
+                               for scope in post_scopes(post)))
+        return fixed
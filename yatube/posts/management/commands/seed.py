@@ -0,0 +1,239 @@
+import datetime as dt
+import io
+import math
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from posts.models import (Comment, FeedEntry, Follow, Group, Post, User,
+                          UserStats)
+
+WORDS = ('кошка', 'собака', 'утро', 'город', 'река', 'поезд', 'книга',
+         'чай', 'дождь', 'море', 'лес', 'письмо', 'дорога', 'окно', 'снег',
+         'вечер', 'музыка', 'друг', 'работа', 'отпуск', 'кофе', 'сад')
+START = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+# Записи лент для подписок пользователей с id в (start, stop]: по индексу
+# (author, -pub_date, -id) берутся последние посты каждого автора.
+# Популярных авторов лента читает сама, их посты не раскладываются.
+FEED_SQL = """
+    INSERT INTO {feed} (user_id, post_id, author_id, pub_date)
+    SELECT f.user_id, p.id, p.author_id, p.pub_date
+    FROM {follow} f
+    JOIN {post} p ON p.id IN (
+        SELECT latest.id FROM {post} latest
+        WHERE latest.author_id = f.author_id
+        ORDER BY latest.pub_date DESC, latest.id DESC
+        LIMIT %s
+    )
+    WHERE f.user_id > %s AND f.user_id <= %s AND f.author_id NOT IN (
+        SELECT user_id FROM {stats} WHERE followers_count > %s
+    )
+"""
+
+
+def zipf_rank(rng, n, s):
+    """Ранг от 1 до n с распределением Ципфа (обратная функция
+    непрерывного распределения, без таблиц весов в памяти).
+    """
+    u = rng.random()
+    if s == 1:
+        rank = n ** u
+    else:
+        rank = ((n ** (1 - s) - 1) * u + 1) ** (1 / (1 - s))
+    return min(n, max(1, int(rank)))
+
+
+@contextmanager
+def explicit_dates():
+    """Отключает auto_now и auto_now_add, чтобы bulk_create сохранил
+    сгенерированные даты.
+    """
+    fields = [Post._meta.get_field('pub_date'),
+              Post._meta.get_field('modified'),
+              Comment._meta.get_field('created')]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими данными: пользователи, группы, '
+            'посты с популярностью авторов по Ципфу, подписки со степенным '
+            'распределением и комментарии. Данные зависят только от --seed '
+            'и размеров; прерванный запуск продолжается с последней пачки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=500000)
+        parser.add_argument('--comments', type=int, default=1000000)
+        parser.add_argument(
+            '--follows', type=float, default=30,
+            help='Среднее число подписок пользователя.')
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Показатель распределения Ципфа для популярности.')
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько дней от 2020-01-01 распределить посты.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--skip-feeds', action='store_true',
+            help='Не заполнять ленты подписок (FeedEntry).')
+
+    def handle(self, *args, **options):
+        if (options['posts'] or options['comments']) and not options['users']:
+            raise CommandError('Для постов и комментариев нужны '
+                               'пользователи.')
+        if options['comments'] and not options['posts']:
+            raise CommandError('Для комментариев нужны посты.')
+        self.options = options
+        self.seed = options['seed']
+        self.batch_size = options['batch_size']
+        self.feed_batch_size = max(
+            1, self.batch_size // settings.FEED_BACKFILL_SIZE)
+        self.post_step = options['days'] * 86400 / max(1, options['posts'])
+        with explicit_dates():
+            self.fill('users', User, options['users'], self.make_users)
+            self.fill('groups', Group, options['groups'], self.make_groups)
+            self.fill('posts', Post, options['posts'], self.make_posts)
+            self.fill('comments', Comment, options['comments'],
+                      self.make_comments)
+            self.fill('follows', None, options['users'], self.make_follows,
+                      done=self.users_done(Follow))
+        # bulk_create не вызывает сигналы: счётчики и ленты досчитываем.
+        call_command('recount', batch_size=self.batch_size,
+                     stdout=io.StringIO())
+        if not options['skip_feeds']:
+            # На пользователя приходится до FEED_BACKFILL_SIZE записей на
+            # каждую подписку, поэтому пачки пользователей здесь меньше.
+            self.fill('feeds', None, options['users'], self.make_feeds,
+                      done=self.users_done(FeedEntry, self.feed_batch_size),
+                      batch_size=self.feed_batch_size)
+        self.stdout.write(self.style.SUCCESS('Готово.'))
+
+    def rows_done(self, model):
+        """Сколько строк уже создано: id идут подряд с 1, а каждая пачка
+        пишется в своей транзакции.
+        """
+        count = model.objects.count()
+        if (model.objects.aggregate(Max('pk'))['pk__max'] or 0) != count:
+            raise CommandError(
+                f'В таблице {model._meta.db_table} есть строки, созданные '
+                'не этой командой; заполняйте пустую базу.')
+        return count
+
+    def users_done(self, model, batch_size=None):
+        """Для подписок и лент пачки идут по пользователям: готовы все
+        пачки до той, в которую попал последний записанный пользователь.
+        """
+        batch_size = batch_size or self.batch_size
+        last = model.objects.aggregate(Max('user_id'))['user_id__max'] or 0
+        return math.ceil(last / batch_size) * batch_size
+
+    def fill(self, label, model, total, make_batch, done=None,
+             batch_size=None):
+        batch_size = batch_size or self.batch_size
+        if done is None:
+            done = self.rows_done(model)
+        if done >= total:
+            return
+        for start in range(done - done % batch_size, total, batch_size):
+            stop = min(total, start + batch_size)
+            # Свой генератор на пачку: повторный запуск с середины даёт
+            # те же данные, что и запуск с начала.
+            rng = random.Random(f'{self.seed}:{label}:{start}')
+            with transaction.atomic():
+                make_batch(rng, start, stop)
+            self.stdout.write(f'{label}: {stop}/{total}')
+
+    def post_date(self, post_id):
+        return START + dt.timedelta(seconds=(post_id - 1) * self.post_step)
+
+    def make_users(self, rng, start, stop):
+        User.objects.bulk_create([
+            User(pk=pk, username=f'user{pk}', first_name='Пользователь',
+                 last_name=str(pk), password='!', date_joined=START)
+            for pk in range(start + 1, stop + 1)
+        ])
+
+    def make_groups(self, rng, start, stop):
+        Group.objects.bulk_create([
+            Group(pk=pk, title=f'Группа {pk}', slug=f'group-{pk}',
+                  description=' '.join(rng.choices(WORDS, k=10)))
+            for pk in range(start + 1, stop + 1)
+        ])
+
+    def make_posts(self, rng, start, stop):
+        users, groups = self.options['users'], self.options['groups']
+        zipf = self.options['zipf']
+        posts = []
+        for pk in range(start + 1, stop + 1):
+            pub_date = self.post_date(pk)
+            group = (zipf_rank(rng, groups, zipf)
+                     if groups and rng.random() < 0.7 else None)
+            posts.append(Post(
+                pk=pk, author_id=zipf_rank(rng, users, zipf), group_id=group,
+                text=' '.join(rng.choices(WORDS, k=rng.randint(5, 60))),
+                pub_date=pub_date, modified=pub_date))
+        Post.objects.bulk_create(posts)
+
+    def make_comments(self, rng, start, stop):
+        users, posts = self.options['users'], self.options['posts']
+        comments = []
+        for pk in range(start + 1, stop + 1):
+            # Свежие посты обсуждают активнее старых.
+            post_id = posts - zipf_rank(rng, posts, self.options['zipf']) + 1
+            created = self.post_date(post_id) + dt.timedelta(
+                seconds=rng.expovariate(1 / 3600))
+            comments.append(Comment(
+                pk=pk, post_id=post_id, author_id=rng.randint(1, users),
+                text=' '.join(rng.choices(WORDS, k=rng.randint(2, 20))),
+                created=created))
+        Comment.objects.bulk_create(comments)
+
+    def make_follows(self, rng, start, stop):
+        users = self.options['users']
+        mean = self.options['follows']
+        follows = []
+        for user_id in range(start + 1, stop + 1):
+            # Число подписок по Парето (alpha = 2, среднее — mean),
+            # авторы — по популярности, как у постов.
+            wanted = min(users - 1, int(mean / 2 * rng.paretovariate(2)))
+            authors = set()
+            for _ in range(wanted * 4):
+                if len(authors) >= wanted:
+                    break
+                author_id = zipf_rank(rng, users, self.options['zipf'])
+                if author_id != user_id:
+                    authors.add(author_id)
+            follows.extend(Follow(user_id=user_id, author_id=author_id)
+                           for author_id in sorted(authors))
+        Follow.objects.bulk_create(follows)
+
+    def make_feeds(self, rng, start, stop):
+        """Ленты пачки пользователей: последние FEED_BACKFILL_SIZE постов
+        каждого автора, на которого они подписаны, как при подписке.
+        Строки не проходят через Python: их миллионы.
+        """
+        quote = connection.ops.quote_name
+        sql = FEED_SQL.format(
+            feed=quote(FeedEntry._meta.db_table),
+            follow=quote(Follow._meta.db_table),
+            post=quote(Post._meta.db_table),
+            stats=quote(UserStats._meta.db_table),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [settings.FEED_BACKFILL_SIZE, start, stop,
+                                 settings.FEED_FANOUT_MAX_FOLLOWERS])
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts.models import Post
+from posts.thumbnails import generate_thumbnails, touch_posts
+
+
+class Command(BaseCommand):
+    help = ('Создаёт превью картинок существующих постов для всех '
+            'THUMBNAIL_GEOMETRIES и варианты для srcset в несколько потоков.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Удалить готовые превью и создать их заново.')
+
+    def handle(self, *args, workers, batch_size, force, **options):
+        posts = Post.objects.exclude(image='').only(
+            'image', 'image_variants').order_by('pk')
+        done = failed = 0
+        last_pk = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                batch = list(posts.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                results = executor.map(
+                    lambda post: self.generate(post, force), batch)
+                ready = []
+                for post, variants in zip(batch, results):
+                    if variants is not None:
+                        post.image_variants = variants
+                        ready.append(post)
+                Post.objects.bulk_update(ready, ['image_variants'])
+                touch_posts([post.pk for post in ready])
+                done += len(ready)
+                failed += len(batch) - len(ready)
+        self.stdout.write(self.style.SUCCESS(
+            f'Превью созданы для постов: {done}, ошибок: {failed}'))
+
+    def generate(self, post, force):
+        try:
+            if force:
+                default.kvstore.delete_thumbnails(ImageFile(post.image))
+            return generate_thumbnails(post.image)
+        except Exception as error:
+            self.stderr.write(f'Пост {post.pk}: {error}')
+            return None
+        finally:
+            connection.close()
@@ -0,0 +1,49 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from core import tasks
+
+from .models import ImageBlob
+from .storage import image_storage
+
+
+def retain(name):
+    """Учитывает ещё один пост с картинкой name."""
+    if not image_storage.is_content_name(name):
+        return
+    if ImageBlob.objects.filter(name=name).update(refs=F('refs') + 1):
+        return
+    try:
+        with transaction.atomic():
+            ImageBlob.objects.create(name=name, refs=1)
+    except IntegrityError:
+        ImageBlob.objects.filter(name=name).update(refs=F('refs') + 1)
+
+
+def release(name):
+    """Снимает ссылку; файл без ссылок удаляется вместе с превью."""
+    if not image_storage.is_content_name(name):
+        return
+    ImageBlob.objects.filter(name=name, refs__gt=0).update(
+        refs=F('refs') - 1)
+    deleted, _ = ImageBlob.objects.filter(name=name, refs=0).delete()
+    if deleted:
+        tasks.submit(delete_image, name)
+
+
+def delete_image(name):
+    # Тот же файл могли загрузить снова, пока задача ждала в очереди.
+    # Пустая строка ImageBlob держит блокировку имени, пока удаляется
+    # файл: хранилище, сохраняющее его же, дождётся её и запишет файл
+    # заново.
+    with transaction.atomic():
+        blob, _ = ImageBlob.objects.select_for_update().get_or_create(
+            name=name)
+        if blob.refs:
+            return
+        image_file = ImageFile(name, image_storage)
+        default.kvstore.delete(image_file)
+        image_storage.delete(name)
+        blob.delete()
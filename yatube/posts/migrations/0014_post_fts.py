@@ -0,0 +1,55 @@
+from django.db import migrations
+
+# Полнотекстовый индекс по Post.text: внешняя FTS5-таблица хранит только
+# индекс, а текст читает из posts_post; триггеры держат её в актуальном
+# состоянии при любых изменениях, включая bulk_create и update().
+# FTS5 есть только в SQLite, на которой и работает проект.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE posts_post_fts USING fts5(
+        text, content='posts_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER posts_post_fts_insert AFTER INSERT ON posts_post BEGIN
+        INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER posts_post_fts_delete AFTER DELETE ON posts_post BEGIN
+        INSERT INTO posts_post_fts(posts_post_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER posts_post_fts_update AFTER UPDATE OF text ON posts_post
+    BEGIN
+        INSERT INTO posts_post_fts(posts_post_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    "INSERT INTO posts_post_fts(posts_post_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS posts_post_fts_insert',
+    'DROP TRIGGER IF EXISTS posts_post_fts_delete',
+    'DROP TRIGGER IF EXISTS posts_post_fts_update',
+    'DROP TABLE IF EXISTS posts_post_fts',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_image_placeholder'),
+    ]
+
+    # Пересоздание posts_post схемным редактором SQLite (например, при
+    # AlterField) удаляет триггеры вместе со старой таблицей: это ловит
+    # проверка posts.E001 (posts/checks.py).
+    operations = [
+        migrations.RunSQL(CREATE_SQL, DROP_SQL),
+    ]
@@ -1,8 +1,17 @@
+import contextvars
+import json
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+
+from .storage import image_storage
 
 User = get_user_model()
 
+# id постов, которые сейчас удаляются через Post.delete().
+deleting_posts = contextvars.ContextVar('deleting_posts', default=frozenset())
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200)
@@ -17,6 +26,23 @@ class Group(models.Model):
         verbose_name_plural = 'Группы'
 
 
+class PostQuerySet(models.QuerySet):
+    # Поля, которые карточки постов читают в шаблонах лент.
+    FEED_FIELDS = (
+        'text', 'pub_date', 'modified', 'image', 'image_variants',
+        'image_placeholder', 'image_width', 'image_height',
+        'author', 'group', 'comments_count',
+        'author__username', 'author__first_name', 'author__last_name',
+        'group__slug', 'group__title',
+    )
+
+    def for_feed(self):
+        """Посты для лент и страницы поста: автор и группа подтягиваются
+        одним JOIN, а из таблиц читаются только нужные шаблонам колонки.
+        """
+        return self.select_related('author', 'group').only(*self.FEED_FIELDS)
+
+
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField(auto_now_add=True)
@@ -36,16 +62,98 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=image_storage,
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев', default=0, editable=False)
+    # Метка версии карточки поста в кэше фрагментов: обновляется при
+    # любом изменении, которое видно в карточке.
+    modified = models.DateTimeField('Изменён', auto_now=True)
+    # Уменьшенные копии картинки для srcset: JSON-список
+    # {"name", "width", "format"}, заполняется фоновой задачей.
+    image_variants = models.TextField(
+        'Варианты картинки', blank=True, default='', editable=False)
+    # Заглушка (data URI на несколько сотен байт) и размеры исходной
+    # картинки: карточка занимает место сразу, а картинка грузится лениво.
+    image_placeholder = models.TextField(
+        'Заглушка картинки', blank=True, default='', editable=False)
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки', null=True, editable=False)
+    image_height = models.PositiveIntegerField(
+        'Высота картинки', null=True, editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self):
         return self.text[:15]
 
+    def delete(self, *args, **kwargs):
+        # Комментарии удаляются каскадом вместе с постом: их сигналы
+        # по deleting_posts пропускают счётчик и сброс кэша поста,
+        # это один раз делает обработчик удаления самого поста.
+        token = deleting_posts.set(deleting_posts.get() | {self.pk})
+        try:
+            return super().delete(*args, **kwargs)
+        finally:
+            deleting_posts.reset(token)
+
+    def get_image_variants(self):
+        return json.loads(self.image_variants) if self.image_variants else []
+
+    @property
+    def image_sources(self):
+        """Атрибуты <source> для <picture>: srcset по форматам,
+        дополнительные форматы первыми, исходный формат последним.
+        """
+        sources = {}
+        for variant in self.get_image_variants():
+            sources.setdefault(variant['format'], []).append('{} {}w'.format(
+                self.image.storage.url(variant['name']), variant['width']))
+        return [
+            {'type': 'image/' + image_format.lower(),
+             'srcset': ', '.join(srcset)}
+            for image_format, srcset in reversed(list(sources.items()))
+        ]
+
+    @property
+    def image_src(self):
+        """Вариант исходного формата шириной карточки — для src."""
+        variants = self.get_image_variants()
+        if not variants:
+            return None
+        primary = [variant for variant in variants
+                   if variant['format'] == variants[0]['format']]
+        variant = min(primary, key=lambda variant: abs(
+            variant['width'] - settings.IMAGE_VARIANT_DEFAULT_WIDTH))
+        return self.image.storage.url(variant['name'])
+
+    def save(self, *args, **kwargs):
+        # Счётчики обновляются в post_save, поэтому сохраняем вместе с ними
+        # в одной транзакции.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
         ordering = ['-pub_date']
+        # Ленты сортируются по (-pub_date, -id): id в индексе нужен, чтобы
+        # и курсорная пагинация читала записи в порядке индекса.
+        indexes = [
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=('group', '-pub_date', '-id'),
+                name='post_group_pub_date_idx'
+            ),
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='post_pub_date_idx'
+            ),
+        ]
 
 
 class Comment(models.Model):
@@ -66,10 +174,20 @@ class Comment(models.Model):
         verbose_name = 'Коммент'
         verbose_name_plural = 'Комменты'
         ordering = ['-created']
+        indexes = [
+            models.Index(
+                fields=('post', '-created'),
+                name='comment_post_created_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -86,6 +204,10 @@ class Follow(models.Model):
     def __str__(self):
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Подписчик'
         verbose_name_plural = 'Подписчики'
@@ -95,3 +217,89 @@ class Follow(models.Model):
                 name='user cant follow himself'
             ),
         ]
+        # Индекс (user, author) создаёт уникальное ограничение выше;
+        # обратный нужен рассылке поста по подписчикам автора.
+        indexes = [
+            models.Index(
+                fields=('author', 'user'),
+                name='follow_author_user_idx'
+            ),
+        ]
+
+
+class FeedEntry(models.Model):
+    """Материализованная лента подписок: запись на каждый пост автора,
+    на которого подписан пользователь. Заполняется при публикации поста
+    (fan-out on write), чтобы follow_index читал один диапазон индекса.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'post'),
+                name='unique feed entry'
+            ),
+        ]
+        indexes = [
+            # Порядок постов при равной дате — по id поста, как у лент
+            # из Post, с которыми эта сливается.
+            models.Index(
+                fields=('user', '-pub_date', '-post'),
+                name='feed_user_pub_date_post_idx'
+            ),
+        ]
+
+
+class UserStats(models.Model):
+    """Денормализованные счётчики пользователя. Поддерживаются сигналами
+    при создании и удалении Post и Follow, сверяются командой recount.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Число подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class ImageBlob(models.Model):
+    """Число постов, ссылающихся на файл картинки с одинаковым содержимым."""
+
+    name = models.CharField(max_length=255, primary_key=True)
+    refs = models.PositiveIntegerField('Число ссылок', default=0)
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return self.name
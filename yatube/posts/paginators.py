@@ -0,0 +1,150 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    """Страница курсорной пагинации с интерфейсом, похожим на Page."""
+
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<CursorPage of %d items>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.encode(NEXT, self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.encode(PREVIOUS, self.object_list[0])
+
+
+class CursorPaginator:
+    """Keyset-пагинация: страница выбирается по значениям полей сортировки
+    последней показанной записи, а не по OFFSET, поэтому не нужен COUNT(*),
+    а глубина страницы не влияет на стоимость запроса.
+    """
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [
+            (name.lstrip('-'), name.startswith('-')) for name in ordering
+        ]
+
+    def encode(self, direction, obj):
+        values = []
+        for name, _ in self.fields:
+            value = getattr(obj, name)
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        raw = json.dumps([direction, values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, values = json.loads(
+                base64.urlsafe_b64decode(padded.encode()))
+        except (TypeError, ValueError, binascii.Error):
+            raise InvalidCursor(cursor)
+        if direction not in (NEXT, PREVIOUS) or (
+                not isinstance(values, list)
+                or len(values) != len(self.fields)):
+            raise InvalidCursor(cursor)
+        return direction, values
+
+    def _seek(self, values, backwards):
+        """Условие «строго после курсора» в порядке сортировки.
+
+        Первое поле дополнительно ограничено нестрогим неравенством, чтобы
+        база могла использовать диапазон по индексу.
+        """
+        condition = Q()
+        for index, (name, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending != backwards else 'gt'
+            step = Q(**{'%s__%s' % (name, lookup): values[index]})
+            for prev_name, prev_value in zip(
+                    [field for field, _ in self.fields[:index]],
+                    values[:index]):
+                step &= Q(**{prev_name: prev_value})
+            condition |= step
+        first, descending = self.fields[0]
+        bound = 'lte' if descending != backwards else 'gte'
+        return Q(**{'%s__%s' % (first, bound): values[0]}) & condition
+
+    def _reversed_ordering(self):
+        return [
+            name if descending else '-' + name
+            for name, descending in self.fields
+        ]
+
+    def page(self, cursor=None):
+        direction, values = NEXT, None
+        if cursor:
+            direction, values = self.decode(cursor)
+        backwards = direction == PREVIOUS
+        queryset = self.object_list
+        if values is not None:
+            try:
+                queryset = queryset.filter(self._seek(values, backwards))
+            except (TypeError, ValueError, ValidationError):
+                raise InvalidCursor(cursor)
+        ordering = self._reversed_ordering() if backwards else self.ordering
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            return CursorPage(rows, self, has_next=True,
+                              has_previous=has_more)
+        return CursorPage(rows, self, has_next=has_more,
+                          has_previous=values is not None)
+
+    def get_page(self, cursor=None):
+        """Как Paginator.get_page: битый курсор даёт первую страницу."""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page(None)
@@ -0,0 +1,72 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+# Триггеры, которые держат FTS_TABLE в актуальном состоянии
+# (миграция 0014_post_fts, проверка posts.E001 в posts/checks.py).
+FTS_TRIGGERS = (
+    'posts_post_fts_insert', 'posts_post_fts_delete', 'posts_post_fts_update')
+# Больше слов в запросе не имеет смысла: каждое сужает выборку.
+MAX_TERMS = 10
+TERM_RE = re.compile(r'\w+')
+
+
+def search_terms(query):
+    return TERM_RE.findall(query)[:MAX_TERMS]
+
+
+def match_query(terms):
+    """Запрос FTS5 из слов пользователя.
+
+    Каждое слово берётся в кавычки, так что операторы и спецсимволы FTS5
+    из ввода не действуют, и ищется как префикс: «кош» найдёт «кошка».
+    """
+    return ' '.join('"%s"*' % term for term in terms)
+
+
+class MatchingIds(RawSQL):
+    """Подзапрос id постов, подходящих под запрос FTS5, для фильтра
+    pk__in. Lookup in сам берёт подзапрос в скобки, а RawSQL добавляет
+    свои: IN ((SELECT ...)) SQLite читает как одно значение.
+    """
+
+    def __init__(self, match):
+        super().__init__(
+            'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(FTS_TABLE),
+            (match,))
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def search_posts(queryset, query):
+    """Посты queryset, подходящие под query, с аннотацией rank:
+    чем меньше, тем релевантнее (bm25 в FTS5).
+    """
+    terms = search_terms(query)
+    no_rank = Value(0.0, output_field=FloatField())
+    if not terms:
+        return queryset.none().annotate(rank=no_rank)
+    if not fts_available():
+        condition = Q()
+        for term in terms:
+            condition &= Q(text__icontains=term)
+        return queryset.filter(condition).annotate(rank=no_rank)
+    match = match_query(terms)
+    quote = connection.ops.quote_name
+    post_id = '%s.%s' % (quote(Post._meta.db_table),
+                         quote(Post._meta.pk.column))
+    rank = RawSQL(
+        'SELECT rank FROM {0} WHERE {0} MATCH %s AND rowid = {1}'.format(
+            FTS_TABLE, post_id),
+        (match,), output_field=FloatField())
+    return queryset.filter(pk__in=MatchingIds(match)).annotate(rank=rank)
@@ -0,0 +1,176 @@
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import caching, counters, feeds, media, timelines
+from .models import Comment, Follow, Group, Post, User, deleting_posts
+
+
+def post_scopes(post):
+    scopes = [caching.GLOBAL, caching.author_scope(post.author.username)]
+    if post.group_id:
+        scopes.append(caching.group_scope(post.group.slug))
+    return scopes
+
+
+@receiver(pre_save, sender=Post)
+def post_presave(sender, instance, **kwargs):
+    # При смене группы нужно сбросить и страницу прежней группы.
+    # Прежняя картинка теряет ссылку, если её заменили.
+    instance._old_group_slug = instance._old_image = None
+    # Новую загрузку при сохранении запишет хранилище и само возьмёт
+    # на неё ссылку (см. ContentAddressedStorage._save).
+    instance._image_uploaded = bool(
+        instance.image) and not instance.image._committed
+    if instance.pk:
+        old = Post.objects.filter(pk=instance.pk).values_list(
+            'group__slug', 'image').first()
+        if old is not None:
+            instance._old_group_slug, instance._old_image = old
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_stats(instance.author_id, 'posts_count', 1)
+        feeds.fan_out_post(instance)
+        timelines.invalidate_timeline(instance.author_id)
+    old_image = getattr(instance, '_old_image', None)
+    uploaded = getattr(instance, '_image_uploaded', False)
+    if uploaded or instance.image.name != old_image:
+        if not uploaded:
+            media.retain(instance.image.name)
+        media.release(old_image)
+    scopes = post_scopes(instance)
+    if getattr(instance, '_old_group_slug', None):
+        scopes.append(caching.group_scope(instance._old_group_slug))
+    caching.bump(*scopes)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.change_user_stats(instance.author_id, 'posts_count', -1)
+    timelines.invalidate_timeline(instance.author_id)
+    media.release(instance.image.name)
+    caching.bump(*post_scopes(instance))
+
+
+def comment_changed(comment):
+    # Число комментариев выводится в карточке поста.
+    post = Post.objects.filter(pk=comment.post_id).select_related(
+        'author', 'group').only('author__username', 'group__slug').first()
+    if post is not None:
+        caching.bump(*post_scopes(post))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_comments_count(instance.post_id, 1)
+        comment_changed(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id in deleting_posts.get():
+        return
+    counters.change_comments_count(instance.post_id, -1)
+    comment_changed(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_stats(instance.author_id, 'followers_count', 1)
+        counters.change_user_stats(instance.user_id, 'following_count', 1)
+        feeds.backfill_feed(instance.user_id, instance.author_id)
+        timelines.invalidate_following(instance.user_id)
+        follow_changed(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.change_user_stats(instance.author_id, 'followers_count', -1)
+    counters.change_user_stats(instance.user_id, 'following_count', -1)
+    feeds.prune_feed(instance.user_id, instance.author_id)
+    timelines.invalidate_following(instance.user_id)
+    follow_changed(instance)
+
+
+def follow_changed(follow):
+    # Профили показывают счётчики подписок и кнопку подписки.
+    usernames = User.objects.filter(
+        pk__in=(follow.user_id, follow.author_id)
+    ).values_list('username', flat=True)
+    caching.bump(*(caching.author_scope(name) for name in usernames))
+
+
+def group_changed(group, *slugs):
+    # Название группы выводится в карточках всех её постов.
+    posts = Post.objects.filter(group=group)
+    posts.update(modified=timezone.now())
+    authors = posts.order_by().values_list(
+        'author__username', flat=True).distinct()
+    caching.bump(
+        caching.GLOBAL,
+        *(caching.group_scope(slug) for slug in slugs if slug),
+        *(caching.author_scope(username) for username in authors),
+    )
+
+
+@receiver(pre_save, sender=Group)
+def group_presave(sender, instance, **kwargs):
+    instance._old_slug = None
+    if instance.pk:
+        instance._old_slug = Group.objects.filter(
+            pk=instance.pk).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    if not created:
+        group_changed(instance, instance.slug, instance._old_slug)
+
+
+@receiver(pre_delete, sender=Group)
+def group_predelete(sender, instance, **kwargs):
+    group_changed(instance, instance.slug)
+
+
+# Поля пользователя, которые выводятся на страницах лент.
+USER_DISPLAY_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def user_display(user):
+    return tuple(getattr(user, field) for field in USER_DISPLAY_FIELDS)
+
+
+@receiver(pre_save, sender=User)
+def user_presave(sender, instance, update_fields, **kwargs):
+    # Вход обновляет только last_login — на ленты это не влияет.
+    instance._old_display = None
+    if instance.pk and (update_fields is None
+                        or set(update_fields) & set(USER_DISPLAY_FIELDS)):
+        instance._old_display = User.objects.filter(
+            pk=instance.pk).values_list(*USER_DISPLAY_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    old = getattr(instance, '_old_display', None)
+    if created or old is None or old == user_display(instance):
+        return
+    # Имя автора выводится в карточках его постов, а области профиля
+    # привязаны к username: при переименовании сбрасываем и прежнюю,
+    # иначе старый адрес профиля отдавался бы из кэша.
+    posts = Post.objects.filter(author=instance)
+    posts.update(modified=timezone.now())
+    slugs = posts.exclude(group=None).order_by().values_list(
+        'group__slug', flat=True).distinct()
+    caching.bump(
+        caching.GLOBAL,
+        caching.author_scope(instance.username),
+        caching.author_scope(old[0]),
+        *(caching.group_scope(slug) for slug in slugs),
+    )
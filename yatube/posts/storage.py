@@ -0,0 +1,53 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+CONTENT_NAME = re.compile(
+    r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранит файлы под sha256 содержимого: upload_to/ab/cd/<sha256>.ext.
+
+    Два уровня подкаталогов держат каталоги небольшими, а одинаковые
+    загрузки получают одно имя: второй раз файл не пишется, и превью
+    sorl-thumbnail для него уже готовы. Учёт ссылок — в posts.media;
+    ссылку на сохранённый файл берёт само хранилище.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(
+            posixpath.dirname(name), digest[:2], digest[2:4],
+            digest + extension)
+
+    def is_content_name(self, name):
+        return bool(name) and CONTENT_NAME.search(name) is not None
+
+    def _save(self, name, content):
+        from . import media
+
+        name = self.content_name(name, content)
+        # Ссылка берётся до проверки файла и в одной транзакции с ней:
+        # запись в ImageBlob блокирует строку, и media.delete_image, который
+        # проверяет её под той же блокировкой, не удалит файл между
+        # проверкой и сохранением поста.
+        with transaction.atomic(savepoint=False):
+            media.retain(name)
+            if self.exists(name):
+                return name
+            return super()._save(name, content)
+
+
+image_storage = ContentAddressedStorage()
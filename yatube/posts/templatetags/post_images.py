@@ -0,0 +1,49 @@
+from django import template
+from django.conf import settings
+
+from core import metrics
+from posts.thumbnails import get_ready_thumbnail
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def ready_thumbnail(context, file_, geometry, **options):
+    """Как {% thumbnail %}, но без генерации: превью создаются в фоне,
+    а до тех пор тег возвращает None.
+
+    Если view положила в контекст thumbnails (ThumbnailResolver),
+    превью всей страницы загружаются одним обращением к хранилищу.
+    """
+    if not file_:
+        return None
+    resolver = context.get('thumbnails')
+    with metrics.timer('thumbnails'):
+        if resolver is not None:
+            return resolver.get(file_, geometry, **options)
+        return get_ready_thumbnail(file_, geometry, **options)
+
+
+@register.simple_tag(takes_context=True)
+def post_picture(context, post):
+    """Что показать на месте картинки поста: варианты для srcset, готовое
+    превью или, пока их нет, исходник — с размерами для width и height.
+    """
+    if not post.image:
+        return None
+    if post.image_variants:
+        aspect_width, aspect_height = settings.IMAGE_VARIANT_ASPECT
+        width = settings.IMAGE_VARIANT_DEFAULT_WIDTH
+        return {
+            'sources': post.image_sources,
+            'src': post.image_src,
+            'width': width,
+            'height': round(width * aspect_height / aspect_width),
+        }
+    geometry, options = settings.THUMBNAIL_GEOMETRIES[0]
+    thumbnail = ready_thumbnail(context, post.image, geometry, **options)
+    if thumbnail:
+        return {'sources': [], 'src': thumbnail.url,
+                'width': thumbnail.width, 'height': thumbnail.height}
+    return {'sources': [], 'src': post.image.url,
+            'width': post.image_width, 'height': post.image_height}
@@ -1,13 +1,25 @@
+import hashlib
+import io
+import os
 import tempfile
 import shutil
+from unittest import mock
 
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from posts.models import Group, Post, Comment
+from PIL import Image
+
+from posts import media
+from posts.forms import PostForm
+from posts.models import Group, ImageBlob, Post, Comment
 
 User = get_user_model()
 
@@ -76,7 +88,9 @@ class PostCreateFormTests(TestCase):
         latest = Post.objects.latest("id")
         self.assertEqual(latest.text, form_data['text'])
         self.assertEqual(latest.group.id, form_data['group'])
-        self.assertEqual(latest.image, 'posts/small.gif')
+        digest = hashlib.sha256(small_gif).hexdigest()
+        self.assertEqual(latest.image,
+                         f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif')
 
     def test_edit_form(self):
 
@@ -119,3 +133,284 @@ class PostCreateFormTests(TestCase):
         )
         self.assertRedirects(responseGuest, reverse(
             'users:login') + f'{"?next=/posts/1/comment/"}')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailPipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Photographer')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        caches['posts'].clear()
+        self.client.force_login(self.user)
+
+    def create_post(self, name='pixel.gif'):
+        uploaded = SimpleUploadedFile(
+            name=name,
+            content=(
+                b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00'
+                b'\x00\x00\x00\x00\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+                b'\x00\x00\x00\x2C\x00\x00\x00\x00\x01\x00\x01\x00'
+                b'\x00\x02\x02\x44\x01\x00\x3B'
+            ),
+            content_type='image/gif',
+        )
+        self.client.post(reverse('posts:post_create'),
+                         {'text': 'С картинкой', 'image': uploaded})
+        return Post.objects.latest('id')
+
+    def test_original_image_shown_until_thumbnail_is_ready(self):
+        post = self.create_post()
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, post.image.url)
+        self.assertNotContains(response, '/media/cache/')
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_thumbnail_generated_after_upload(self):
+        post = self.create_post()
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '/media/cache/')
+        self.assertNotContains(response, post.image.url)
+
+    def test_placeholder_stored_and_rendered_with_lazy_image(self):
+        post = self.create_post()
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(post.image_placeholder), 1000)
+        self.assertEqual((post.image_width, post.image_height), (1, 1))
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, post.image_placeholder)
+        self.assertContains(response, 'width="1" height="1" loading="lazy"')
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_variants_recorded_and_rendered_as_srcset(self):
+        post = Post.objects.get(pk=self.create_post().pk)
+        variants = post.get_image_variants()
+        self.assertEqual(
+            sorted({variant['width'] for variant in variants}),
+            [480, 960, 1440])
+        response = self.client.get(reverse('posts:index'))
+        for variant in variants:
+            self.assertContains(response, '{} {}w'.format(
+                post.image.storage.url(variant['name']), variant['width']))
+        self.assertContains(response, f'src="{post.image_src}"')
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_page_thumbnails_are_resolved_in_one_lookup(self):
+        for i in range(3):
+            self.create_post(f'pixel{i}.gif')
+        # Посты без записанных вариантов, например загруженные раньше.
+        Post.objects.update(image_variants='')
+        caches['posts'].clear()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '/media/cache/', count=3)
+        kvstore_queries = [query for query in queries.captured_queries
+                           if 'thumbnail_kvstore' in query['sql']]
+        self.assertEqual(len(kvstore_queries), 1)
+
+
+@override_settings(IMAGE_UPLOAD_MAX_DIMENSION=100,
+                   IMAGE_UPLOAD_MAX_BYTES=50 * 1024)
+class ImageNormalizationTests(TestCase):
+    def make_jpeg(self, size, orientation=None):
+        image = Image.new('RGB', size, 'red')
+        exif = Image.Exif()
+        exif[0x010E] = 'Описание с камеры'
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', exif=exif.tobytes())
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(),
+                                  content_type='image/jpeg')
+
+    def clean_image(self, uploaded):
+        form = PostForm({'text': 'Фото'}, {'image': uploaded})
+        self.assertTrue(form.is_valid(), form.errors)
+        return Image.open(form.cleaned_data['image'])
+
+    def test_large_image_downscaled_rotated_and_stripped(self):
+        # Orientation 6: камеру держали вертикально, кадр повёрнут на 90°.
+        image = self.clean_image(self.make_jpeg((400, 200), orientation=6))
+        self.assertEqual(image.size, (50, 100))
+        self.assertNotIn('exif', image.info)
+
+    def test_png_loses_exif(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'SecretCam'
+        buffer = io.BytesIO()
+        Image.new('RGB', (80, 40), 'red').save(
+            buffer, 'PNG', exif=exif.tobytes())
+        uploaded = SimpleUploadedFile('photo.png', buffer.getvalue())
+        image = self.clean_image(uploaded)
+        self.assertEqual(image.format, 'PNG')
+        self.assertNotIn('exif', image.info)
+        image.fp.seek(0)
+        self.assertNotIn(b'SecretCam', image.fp.read())
+
+    def test_gif_loses_comment(self):
+        buffer = io.BytesIO()
+        Image.new('P', (80, 40)).save(buffer, 'GIF', comment=b'SecretCam')
+        uploaded = SimpleUploadedFile('photo.gif', buffer.getvalue())
+        image = self.clean_image(uploaded)
+        self.assertEqual(image.format, 'GIF')
+        self.assertNotIn('comment', image.info)
+
+    def test_small_clean_image_is_kept_as_is(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (80, 40), 'red').save(buffer, 'PNG')
+        uploaded = SimpleUploadedFile('small.png', buffer.getvalue())
+        form = PostForm({'text': 'Фото'}, {'image': uploaded})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertIs(form.cleaned_data['image'], uploaded)
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_image_that_cannot_fit_byte_limit_is_rejected(self):
+        form = PostForm({'text': 'Фото'},
+                        {'image': self.make_jpeg((400, 200))})
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, BACKGROUND_TASKS_EAGER=True)
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Reposter')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def upload(self, name):
+        buffer = io.BytesIO()
+        Image.new('RGB', (20, 10), 'blue').save(buffer, 'PNG')
+        self.client.post(reverse('posts:post_create'), {
+            'text': name,
+            'image': SimpleUploadedFile(name, buffer.getvalue()),
+        })
+        return Post.objects.get(text=name)
+
+    def test_duplicates_share_one_file_until_last_reference(self):
+        first = self.upload('first.png')
+        second = self.upload('second.png')
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(ImageBlob.objects.get(name=name).refs, 2)
+
+        first.delete()
+        self.assertTrue(second.image.storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).refs, 1)
+
+        second.delete()
+        self.assertFalse(second.image.storage.exists(name))
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+
+    @override_settings(BACKGROUND_TASKS_EAGER=False)
+    def test_queued_delete_does_not_remove_file_being_reused(self):
+        first = self.upload('first.png')
+        name = first.image.name
+        storage = first.image.storage
+        # Удаление файла последней ссылки ждёт в очереди (в TestCase
+        # on_commit не наступает) и выполняется, пока второй пост
+        # с той же картинкой сохраняется: сразу после проверки файла.
+        first.delete()
+        exists = storage.exists
+
+        def exists_then_delete(checked_name):
+            result = exists(checked_name)
+            if checked_name == name:
+                media.delete_image(name)
+            return result
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (20, 10), 'blue').save(buffer, 'PNG')
+        with mock.patch.object(storage, 'exists', exists_then_delete):
+            second = Post.objects.create(
+                author=self.user, text='second.png',
+                image=SimpleUploadedFile('second.png', buffer.getvalue()))
+        self.assertEqual(second.image.name, name)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).refs, 1)
+
+    def test_gc_removes_only_unreferenced_files(self):
+        post = self.upload('kept.png')
+        orphans = ('posts/00/00/' + '0' * 64 + '.png',
+                   'posts/legacy.png', 'cache/00/00/stale.jpg')
+        for name in orphans:
+            path = os.path.join(TEMP_MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file_:
+                file_.write(b'x' * 10)
+        storage = post.image.storage
+        variants = [variant['name'] for variant in post.get_image_variants()]
+
+        output = io.StringIO()
+        call_command('gc_media', dry_run=True, min_age=0, stdout=output)
+        self.assertIn('Будет удалено файлов: 3', output.getvalue())
+        self.assertIn('освобождено байт: 30', output.getvalue())
+        self.assertTrue(all(storage.exists(name) for name in orphans))
+
+        call_command('gc_media', min_age=0, stdout=io.StringIO())
+        self.assertFalse(any(storage.exists(name) for name in orphans))
+        self.assertTrue(storage.exists(post.image.name))
+        self.assertTrue(all(storage.exists(name) for name in variants))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class UploadLimitTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    @override_settings(POST_UPLOAD_MAX_BYTES=1024 * 1024)
+    def test_oversized_upload_rejected_with_form_error(self):
+        big = SimpleUploadedFile('big.png', b'x' * (2 * 1024 * 1024))
+        response = self.client.post(reverse('posts:post_create'),
+                                    {'text': 'Большой', 'image': big})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('image', response.context['form'].errors)
+        self.assertFalse(Post.objects.filter(author=self.user).exists())
+
+    @override_settings(POST_UPLOAD_MAX_BYTES=1024 * 1024)
+    def test_oversized_upload_with_csrf_token_gets_form_error(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.get(reverse('posts:post_create'))
+        token = response.context['csrf_token']
+        big = SimpleUploadedFile('big.png', b'x' * (2 * 1024 * 1024))
+        response = client.post(reverse('posts:post_create'), {
+            'csrfmiddlewaretoken': token, 'text': 'Большой', 'image': big})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('image', response.context['form'].errors)
+        self.assertFalse(Post.objects.filter(author=self.user).exists())
+
+    def test_csrf_still_checked(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post(reverse('posts:post_create'),
+                               {'text': 'Без токена'})
+        self.assertTemplateUsed(response, 'core/403csrf.html')
+        self.assertFalse(Post.objects.filter(author=self.user).exists())
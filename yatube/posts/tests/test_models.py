@@ -1,7 +1,17 @@
+import re
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-from ..models import Group, Post
+from ..counters import get_user_stats
+from ..models import Comment, FeedEntry, Follow, Group, Post, UserStats
 
 User = get_user_model()
 
@@ -30,3 +40,200 @@ class PostModelTest(TestCase):
         post = PostModelTest.post
         expected_object_name = post.text[:15]
         self.assertEqual(expected_object_name, str(post))
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_counters_follow_creates_and_deletes(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        Post.objects.create(author=self.author, text='Ещё пост')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.stats(self.author).posts_count, 2)
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+        post.delete()
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        Follow.objects.filter(user=self.reader).delete()
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+
+    def test_cascade_delete_updates_counters(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.reader.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+
+    def test_recount_repairs_drift(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        UserStats.objects.filter(user=self.author).update(posts_count=7)
+        UserStats.objects.filter(user=self.reader).delete()
+        Post.objects.filter(pk=post.pk).update(comments_count=0)
+        call_command('recount', stdout=StringIO())
+        self.assertEqual(get_user_stats(self.author.pk).posts_count, 1)
+        self.assertTrue(UserStats.objects.filter(user=self.reader).exists())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+    def test_recount_refreshes_cached_cards(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        Post.objects.filter(pk=post.pk).update(comments_count=5)
+        UserStats.objects.filter(user=self.author).update(followers_count=3)
+        caches['posts'].clear()
+        address = reverse('posts:profile',
+                          kwargs={'username': self.author.username})
+        response = self.client.get(address)
+        self.assertContains(response, 'Комментариев: 5')
+        self.assertContains(response, 'Подписчиков: 3')
+        call_command('recount', stdout=StringIO())
+        self.assertContains(self.client.get(address), 'Подписчиков: 0')
+        for address in (address, reverse('posts:index')):
+            with self.subTest(address=address):
+                response = self.client.get(address)
+                self.assertContains(response, 'Комментариев: 1')
+                self.assertNotContains(response, 'Комментариев: 5')
+
+
+class QueryPlanTest(TestCase):
+    """Запросы, которые делают view лент, читают данные в порядке индекса:
+    без полного прохода по таблице и без сортировки во временном B-дереве.
+    Проверяются настоящие запросы view, снятые CaptureQueriesContext,
+    во всех режимах ленты подписок.
+    """
+    # «SCAN таблица» без индекса — полный проход; старые версии SQLite
+    # пишут «SCAN TABLE таблица».
+    FULL_SCAN = re.compile(r'\bSCAN (TABLE )?\w+$', re.MULTILINE)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        authors = [User.objects.create_user(username=f'author{i}')
+                   for i in range(3)]
+        for author in authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        for i in range(30):
+            Post.objects.create(text=f'Пост {i}', author=authors[i % 3],
+                                group=cls.group)
+        cls.post = Post.objects.latest('id')
+        Comment.objects.create(text='Комментарий', post=cls.post,
+                               author=cls.reader)
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+
+    def pages(self):
+        """(название, настройки, адрес) для всех режимов лент."""
+        feeds = {
+            'index': reverse('posts:index'),
+            'group_list': reverse('posts:group_list',
+                                  kwargs={'slug': 'group'}),
+            'profile': reverse('posts:profile',
+                               kwargs={'username': 'author0'}),
+        }
+        for name, address in feeds.items():
+            yield name, {}, address + '?page=2'
+            yield name + ' cursor', {'POSTS_PAGINATION': 'cursor'}, address
+        yield 'post_detail', {}, reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.pk})
+        follow = reverse('posts:follow_index')
+        yield 'follow_index merged', {}, follow + '?page=2'
+        yield 'follow_index beyond horizon', {
+            'TIMELINE_LENGTH': 2}, follow + '?page=2'
+        yield 'follow_index materialized', {
+            'FEED_MERGE_MAX_AUTHORS': 0}, follow + '?page=2'
+        yield 'follow_index popular', {
+            'FEED_MERGE_MAX_AUTHORS': 0, 'FEED_FANOUT_MAX_FOLLOWERS': 0,
+        }, follow + '?page=2'
+        yield 'follow_index cursor', {'POSTS_PAGINATION': 'cursor'}, follow
+        yield 'follow_index popular cursor', {
+            'POSTS_PAGINATION': 'cursor', 'FEED_FANOUT_MAX_FOLLOWERS': 0,
+        }, follow
+
+    def captured(self):
+        for name, overrides, address in self.pages():
+            caches['posts'].clear()
+            with self.settings(**overrides):
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(address)
+                    page = response.context.get('page_obj')
+                    if getattr(page, 'next_cursor', None):
+                        # Следующая страница — запрос с условием курсора.
+                        self.client.get(
+                            address + '?cursor=' + page.next_cursor)
+            for query in context.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    yield name, query['sql']
+        yield 'fan-out', str(Follow.objects.filter(
+            author=self.reader).order_by('user_id').values_list(
+                'user_id', flat=True)[:1000].query)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def test_feed_queries_use_indexes(self):
+        for name, sql in self.captured():
+            with self.subTest(page=name, sql=sql):
+                plan = self.explain(sql)
+                self.assertNotRegex(plan, self.FULL_SCAN)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+class SeedCommandTest(TestCase):
+    SIZES = {'users': 30, 'groups': 3, 'posts': 250, 'comments': 300,
+             'follows': 4, 'batch_size': 40}
+
+    def seed(self):
+        call_command('seed', stdout=StringIO(), **self.SIZES)
+
+    def snapshot(self):
+        return (
+            list(Post.objects.order_by('pk').values_list(
+                'pk', 'author_id', 'group_id', 'text', 'pub_date')),
+            list(Comment.objects.order_by('pk').values_list(
+                'post_id', 'author_id', 'created')),
+            list(Follow.objects.order_by('user_id', 'author_id')
+                 .values_list('user_id', 'author_id')),
+            FeedEntry.objects.count(),
+        )
+
+    def test_seed_is_deterministic_and_resumable(self):
+        self.seed()
+        full = self.snapshot()
+        self.assertEqual(len(full[0]), 250)
+        self.assertEqual(len(full[1]), 300)
+        self.assertGreater(full[3], 0)
+        # Популярность авторов скошена: у первого автора постов больше,
+        # чем в среднем.
+        self.assertGreater(get_user_stats(1).posts_count, 250 / 30)
+        self.assertEqual(UserStats.objects.count(), 30)
+        # Обрываем запуск посреди постов и дописываем.
+        FeedEntry.objects.all().delete()
+        Follow.objects.all().delete()
+        Comment.objects.all().delete()
+        Post.objects.filter(pk__gt=120).delete()
+        self.seed()
+        self.assertEqual(self.snapshot(), full)
+
+    def test_refuses_foreign_rows(self):
+        user = User.objects.create_user(username='stranger')
+        User.objects.filter(pk=user.pk).update(id=100)
+        with self.assertRaises(CommandError):
+            self.seed()
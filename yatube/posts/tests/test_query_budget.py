@@ -0,0 +1,161 @@
+import io
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from PIL import Image
+
+from about import urls as about_urls
+from posts import urls as posts_urls
+from posts.models import Comment, Group, Post
+from users import urls as users_urls
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+URLCONFS = (posts_urls, users_urls, about_urls)
+PASSWORD = 'Sup3r-secret-pass'
+
+
+@override_settings(QUERY_BUDGET_STRICT=True, MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class QueryBudgetTest(TestCase):
+    """Обходит все URL posts, users и about на заполненной базе
+    с холодным кэшем: в строгом режиме view, вышедшая за свой
+    query_budget, падает с QueryBudgetExceeded.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(
+            username='Author', email='author@example.com', password=PASSWORD)
+        cls.reader = User.objects.create_user(
+            username='Reader', password=PASSWORD)
+        commenters = [User.objects.create_user(username=f'Commenter{i}')
+                      for i in range(3)]
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='dogs',
+            description='Тестовое описание',
+        )
+        # Пост с картинкой: для него страницы ищут готовые превью.
+        Post.objects.create(
+            author=cls.author, group=cls.group, text='С картинкой',
+            image=cls.image('pixel.gif', 'white'))
+        for i in range(14):
+            Post.objects.create(author=cls.author, group=cls.group,
+                                text=f'Тестовый пост {i}')
+        cls.post = Post.objects.latest('id')
+        for commenter in commenters:
+            Comment.objects.create(post=cls.post, author=commenter,
+                                   text='Комментарий')
+        client = Client()
+        client.force_login(cls.reader)
+        client.get(reverse('posts:profile_follow',
+                           kwargs={'username': cls.author.username}))
+
+    @staticmethod
+    def image(name, color):
+        # Разные картинки: одинаковые делят один файл и обходятся дешевле.
+        content = io.BytesIO()
+        Image.new('RGB', (2, 2), color).save(content, 'GIF')
+        return SimpleUploadedFile(name, content.getvalue(),
+                                  content_type='image/gif')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def patterns(self):
+        values = {
+            'slug': self.group.slug,
+            'username': self.author.username,
+            'post_id': self.post.pk,
+        }
+        for urlconf in URLCONFS:
+            for pattern in urlconf.urlpatterns:
+                kwargs = {name: values[name]
+                          for name in pattern.pattern.converters}
+                url = reverse(f'{urlconf.app_name}:{pattern.name}',
+                              kwargs=kwargs)
+                yield url, pattern
+
+    def request(self, user, url, data=None):
+        """Запрос с холодным кэшем; изменения в базе откатываются,
+        чтобы каждый URL видел одни и те же данные.
+        """
+        caches['posts'].clear()
+        client = Client(HTTP_REFERER='/')
+        if user is not None:
+            client.force_login(user)
+        with transaction.atomic():
+            if data is None:
+                response = client.get(url)
+            else:
+                response = client.post(url, data)
+            transaction.set_rollback(True)
+        return response
+
+    def test_every_view_has_budget(self):
+        for url, pattern in self.patterns():
+            with self.subTest(url=url):
+                self.assertIsInstance(
+                    getattr(pattern.callback, 'query_budget', None), int)
+
+    def test_get_within_budget(self):
+        urls = [url for url, _ in self.patterns()]
+        urls += [
+            reverse('posts:index') + '?page=2',
+            reverse('posts:search') + '?q=Тестовый пост',
+        ]
+        for url in urls:
+            for user in (None, self.reader, self.author):
+                with self.subTest(url=url, user=user):
+                    response = self.request(user, url)
+                    self.assertLess(response.status_code, 500)
+
+    def test_delete_does_not_grow_with_comments(self):
+        post = Post.objects.create(author=self.author, text='Обсуждаемый')
+        Comment.objects.bulk_create(
+            Comment(post=post, author=self.reader, text=f'Комментарий {i}')
+            for i in range(20))
+        url = reverse('posts:post_delete', kwargs={'post_id': post.pk})
+        response = self.request(self.author, url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_forms_within_budget(self):
+        forms = {
+            reverse('posts:post_create'): {
+                'text': 'Новый пост', 'group': self.group.pk,
+                'image': self.image('new.gif', 'red')},
+            reverse('posts:post_edit', kwargs={'post_id': self.post.pk}): {
+                'text': 'Изменённый пост', 'group': self.group.pk,
+                'image': self.image('edited.gif', 'blue')},
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}): {
+                'text': 'Новый комментарий'},
+        }
+        for url, data in forms.items():
+            with self.subTest(url=url):
+                response = self.request(self.author, url, data)
+                self.assertEqual(response.status_code, 302)
+        anonymous_forms = {
+            reverse('users:signup'): {
+                'first_name': 'Новый', 'last_name': 'Пользователь',
+                'username': 'Newcomer', 'email': 'new@example.com',
+                'password1': PASSWORD, 'password2': PASSWORD},
+            reverse('users:login'): {
+                'username': self.reader.username, 'password': PASSWORD},
+            reverse('users:password_reset'): {'email': self.author.email},
+        }
+        for url, data in anonymous_forms.items():
+            with self.subTest(url=url):
+                response = self.request(None, url, data)
+                self.assertLess(response.status_code, 500)
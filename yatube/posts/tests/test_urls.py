@@ -1,5 +1,5 @@
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
+from django.core.cache import caches
 from django.test import TestCase, Client
 from django.urls import reverse
 from http import HTTPStatus
@@ -27,7 +27,7 @@ class PostsURLTests(TestCase):
         )
 
     def setUp(self):
-        cache.clear()
+        caches['posts'].clear()
         self.guest_client = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
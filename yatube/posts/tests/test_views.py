@@ -1,11 +1,23 @@
 
-from django.core.cache import cache
+import json
+import tempfile
+from hashlib import md5
+from io import StringIO
+
+from django.core.cache import cache, caches
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django import forms
 
-from posts.models import Group, Post, Follow
+from core.decorators import LOCK_KEY, STATS_KEY, get_stats, reset_stats
+from posts import loadgen
+from posts.caching import PAGE_KEY
+from posts.checks import check_fts_triggers
+from posts.models import Comment, FeedEntry, Group, Post, Follow
 
 User = get_user_model()
 
@@ -30,7 +42,8 @@ class PostsURLTests(TestCase):
         )
 
     def setUp(self):
-        cache.clear()
+        caches['posts'].clear()
+        reset_stats()
         self.guest_client = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
@@ -101,7 +114,7 @@ class PostsURLTests(TestCase):
                 if adress == 'posts/group_list.html':
                     self.assertEqual(obj.group, self.group)
 
-        cache.clear()
+        caches['posts'].clear()
         post = Post.objects.create(
             text='Тестовый текст добавления',
             group=self.group,
@@ -136,20 +149,75 @@ class PostsURLTests(TestCase):
         self.assertEqual(group, posts_count, error_name)
 
     def test_cache_index(self):
-        """Проверка хранения и очищения кэша для index."""
-        response = self.authorized_client.get(reverse('posts:index'))
+        """Index берётся из кэша, пока нет записей, и сразу обновляется
+        после создания поста."""
+        response = self.guest_client.get(reverse('posts:index'))
         posts = response.content
+        with self.assertNumQueries(0):
+            response_old = self.guest_client.get(reverse('posts:index'))
+        self.assertEqual(response_old.content, posts)
         Post.objects.create(
             text='test_new_post',
             author=self.user,
         )
-        response_old = self.authorized_client.get(reverse('posts:index'))
-        old_posts = response_old.content
-        self.assertEqual(old_posts, posts)
-        cache.clear()
-        response_new = self.authorized_client.get(reverse('posts:index'))
-        new_posts = response_new.content
-        self.assertNotEqual(old_posts, new_posts)
+        response_new = self.guest_client.get(reverse('posts:index'))
+        self.assertNotEqual(response_new.content, posts)
+        self.assertIn(b'test_new_post', response_new.content)
+
+    def test_cache_group_and_profile_invalidated_by_edit(self):
+        pages = (
+            reverse('posts:group_list', kwargs={'slug': 'dogs'}),
+            reverse('posts:profile', kwargs={'username': 'UserAuthor'}),
+        )
+        for address in pages:
+            self.guest_client.get(address)
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Отредактированный пост'
+        post.save()
+        for address in pages:
+            with self.subTest(address=address):
+                response = self.guest_client.get(address)
+                self.assertIn('Отредактированный пост',
+                              response.content.decode())
+
+    def test_cache_index_serves_stale_while_locked(self):
+        """Пока другой воркер держит блокировку, отдаётся старая страница,
+        после её снятия страница перестраивается."""
+        self.guest_client.get(reverse('posts:index'))
+        Post.objects.create(text='test_new_post', author=self.user)
+        lock_key = LOCK_KEY.format(view='posts.views.index',
+                                   key=PAGE_KEY.format(
+                                       path=md5(b'/').hexdigest(), user=0))
+        cache.set(lock_key, 1)
+        stale = self.guest_client.get(reverse('posts:index'))
+        self.assertNotIn(b'test_new_post', stale.content)
+        cache.delete(lock_key)
+        fresh = self.guest_client.get(reverse('posts:index'))
+        self.assertIn(b'test_new_post', fresh.content)
+        self.assertEqual(get_stats('posts.views.index'),
+                         {'hit': 0, 'miss': 2, 'stale': 1})
+
+    @override_settings(CACHE_SWR_LOCK_TIMEOUT=0.1)
+    def test_cache_waiting_worker_keeps_foreign_lock(self):
+        """Не дождавшийся страницы воркер строит её сам и не снимает
+        блокировку, которую держит другой."""
+        lock_key = LOCK_KEY.format(view='posts.views.index',
+                                   key=PAGE_KEY.format(
+                                       path=md5(b'/').hexdigest(), user=0))
+        cache.set(lock_key, 1)
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cache.get(lock_key), 1)
+        cache.delete(lock_key)
+
+    @override_settings(CACHE_SWR_STATS_FLUSH_INTERVAL=60)
+    def test_cache_hits_do_not_write_shared_stats(self):
+        self.guest_client.get(reverse('posts:index'))
+        with self.assertNumQueries(0):
+            self.guest_client.get(reverse('posts:index'))
+        self.assertEqual(get_stats('posts.views.index')['hit'], 1)
+        self.assertIsNone(cache.get(STATS_KEY.format(
+            view='posts.views.index', outcome='hit')))
 
     def test_following_correctly(self):
         follow_count = Follow.objects.filter(user=self.user2).count()
@@ -201,7 +269,7 @@ class PaginatorViewsTest(TestCase):
         Post.objects.bulk_create(post_list)
 
     def setUp(self):
-        cache.clear()
+        caches['posts'].clear()
         self.guest_client = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
@@ -233,3 +301,469 @@ class PaginatorViewsTest(TestCase):
         response = self.client.get(reverse(
             'posts:group_list', kwargs={'slug': 'dogs'}) + '?page=2')
         self.assertEqual(len(response.context['page_obj']), 5)
+
+
+@override_settings(POSTS_PAGINATION='cursor')
+class CursorPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            description='Группа для тестов',
+            slug='dogs',
+        )
+        cls.user = User.objects.create_user(username='UserAuthor')
+        cls.follower = User.objects.create_user(username='Follower')
+        Post.objects.bulk_create([
+            Post(text=f'Тестовый текст {i}', group=cls.group, author=cls.user)
+            for i in range(15)
+        ])
+        Follow.objects.create(user=cls.follower, author=cls.user)
+
+    def setUp(self):
+        caches['posts'].clear()
+        self.follower_client = Client()
+        self.follower_client.force_login(self.follower)
+
+    def test_cursor_pages_walk_all_feeds(self):
+        pages = (
+            (self.client, reverse('posts:index')),
+            (self.client, reverse('posts:group_list',
+                                  kwargs={'slug': 'dogs'})),
+            (self.client, reverse('posts:profile',
+                                  kwargs={'username': 'UserAuthor'})),
+            (self.follower_client, reverse('posts:follow_index')),
+        )
+        for client, address in pages:
+            with self.subTest(address=address):
+                first = client.get(address).context['page_obj']
+                self.assertEqual(len(first), 10)
+                self.assertFalse(first.has_previous())
+                second = client.get(
+                    address + '?cursor=' + first.next_cursor
+                ).context['page_obj']
+                self.assertEqual(len(second), 5)
+                self.assertFalse(second.has_next())
+                back = client.get(
+                    address + '?cursor=' + second.previous_cursor
+                ).context['page_obj']
+                self.assertEqual(list(back), list(first))
+
+    def test_cursor_page_is_stable_under_inserts(self):
+        first = self.client.get(reverse('posts:index')).context['page_obj']
+        Post.objects.create(text='Новый пост', author=self.user)
+        caches['posts'].clear()
+        second = self.client.get(
+            reverse('posts:index') + '?cursor=' + first.next_cursor
+        ).context['page_obj']
+        seen = {post.pk for post in first} | {post.pk for post in second}
+        self.assertEqual(len(second), 5)
+        self.assertEqual(
+            seen, set(Post.objects.exclude(text='Новый пост')
+                      .values_list('pk', flat=True)))
+
+    def test_broken_cursor_returns_first_page(self):
+        response = self.client.get(reverse('posts:index') + '?cursor=zzz')
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+
+class FollowFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='FeedAuthor')
+        cls.followers = [
+            User.objects.create_user(username=f'Follower{i}')
+            for i in range(3)
+        ]
+        cls.old_post = Post.objects.create(
+            text='Пост до подписки', author=cls.author)
+
+    def setUp(self):
+        caches['posts'].clear()
+        self.client = Client()
+        self.client.force_login(self.followers[0])
+
+    def test_follow_backfills_and_unfollow_prunes_feed(self):
+        self.client.get(reverse('posts:profile_follow',
+                                kwargs={'username': 'FeedAuthor'}))
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.followers[0], post=self.old_post).exists())
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertIn(self.old_post, response.context['page_obj'])
+        self.client.get(reverse('posts:profile_unfollow',
+                                kwargs={'username': 'FeedAuthor'}))
+        self.assertFalse(
+            FeedEntry.objects.filter(user=self.followers[0]).exists())
+
+    @override_settings(FEED_FANOUT_INLINE_LIMIT=1, FEED_FANOUT_BATCH_SIZE=2,
+                       BACKGROUND_TASKS_EAGER=True)
+    def test_large_fan_out_runs_in_batches(self):
+        for follower in self.followers:
+            Follow.objects.create(user=follower, author=self.author)
+        post = Post.objects.create(text='Новый пост', author=self.author)
+        self.assertEqual(
+            FeedEntry.objects.filter(post=post).count(), len(self.followers))
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['page_obj'][0], post)
+
+    @override_settings(FEED_FANOUT_INLINE_LIMIT=1, FEED_FANOUT_MAX_FOLLOWERS=1,
+                       FEED_MERGE_MAX_AUTHORS=0, BACKGROUND_TASKS_EAGER=True)
+    def test_popular_author_is_merged_at_read_time(self):
+        other = User.objects.create_user(username='OtherAuthor')
+        Follow.objects.create(user=self.followers[0], author=other)
+        # Первая подписка ещё раскладывает старый пост в ленту, дальше
+        # автор становится популярным.
+        for follower in self.followers:
+            Follow.objects.create(user=follower, author=self.author)
+        for i in range(12):
+            Post.objects.create(text=f'Пост {i}',
+                                author=(self.author, other)[i % 2])
+        self.assertFalse(FeedEntry.objects.filter(
+            author=self.author).exclude(post=self.old_post).exists())
+        expected = list(Post.objects.filter(
+            author__following__user=self.followers[0]
+        ).order_by('-pub_date', '-id'))
+        address = reverse('posts:follow_index')
+        pages = []
+        for number in (1, 2):
+            response = self.client.get(address + f'?page={number}')
+            pages.extend(response.context['page_obj'])
+        self.assertEqual(pages, expected)
+        with self.settings(POSTS_PAGINATION='cursor'):
+            pages, cursor = [], ''
+            while cursor is not None:
+                response = self.client.get(address + f'?cursor={cursor}')
+                page = response.context['page_obj']
+                pages.extend(page)
+                cursor = page.next_cursor
+        self.assertEqual(pages, expected)
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=2, FEED_MERGE_MAX_AUTHORS=0,
+                       POSTS_PAGINATION='cursor', BACKGROUND_TASKS_EAGER=True)
+    def test_cursor_ties_between_popular_and_materialized_posts(self):
+        other = User.objects.create_user(username='OtherAuthor')
+        # Посты other раскладываются двум читателям, так что id FeedEntry
+        # растут вдвое быстрее id постов; FeedAuthor популярен.
+        for follower in self.followers[:2]:
+            Follow.objects.create(user=follower, author=other)
+        for follower in self.followers:
+            Follow.objects.create(user=follower, author=self.author)
+        for i in range(24):
+            Post.objects.create(text=f'Пост {i}',
+                                author=(self.author, other)[i % 2])
+        pub_date = Post.objects.latest('pk').pub_date
+        Post.objects.update(pub_date=pub_date)
+        FeedEntry.objects.update(pub_date=pub_date)
+        expected = list(Post.objects.filter(
+            author__following__user=self.followers[0]
+        ).order_by('-pub_date', '-id'))
+        pages, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get(
+                reverse('posts:follow_index') + f'?cursor={cursor}')
+            page = response.context['page_obj']
+            pages.extend(page)
+            cursor = page.next_cursor
+        self.assertEqual(pages, expected)
+
+
+class MergedFollowFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.authors = [
+            User.objects.create_user(username=f'Author{i}')
+            for i in range(3)
+        ]
+        for author in cls.authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        for i in range(12):
+            Post.objects.create(text=f'Пост {i}',
+                                author=cls.authors[i % 3])
+
+    def setUp(self):
+        caches['posts'].clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def get_pages(self):
+        pages = []
+        for number in (1, 2):
+            response = self.client.get(
+                reverse('posts:follow_index') + f'?page={number}')
+            pages.extend(response.context['page_obj'])
+        return pages
+
+    def test_merged_feed_matches_sql_order(self):
+        expected = list(Post.objects.filter(
+            author__following__user=self.reader).order_by('-pub_date', '-id'))
+        self.assertEqual(self.get_pages(), expected)
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_truncated_timelines_fall_back_to_sql(self):
+        expected = list(Post.objects.filter(
+            author__following__user=self.reader).order_by('-pub_date', '-id'))
+        self.assertEqual(self.get_pages(), expected)
+
+    def test_new_post_and_unfollow_invalidate_caches(self):
+        self.get_pages()
+        post = Post.objects.create(text='Свежий', author=self.authors[0])
+        self.assertEqual(self.get_pages()[0], post)
+        Follow.objects.filter(user=self.reader,
+                              author=self.authors[0]).delete()
+        self.assertNotIn(post, self.get_pages())
+
+
+class FeedQueryCountTest(TestCase):
+    """Число запросов на страницу не зависит от числа постов на ней."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.author = User.objects.create_user(
+            username='Author', first_name='Лев', last_name='Толстой')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        for i in range(10):
+            author = User.objects.create_user(username=f'Author{i}')
+            group = Group.objects.create(title=f'Группа {i}',
+                                         slug=f'group-{i}')
+            Follow.objects.create(user=cls.reader, author=author)
+            Post.objects.create(text=f'Пост {i}', author=author, group=group)
+            Post.objects.create(text=f'Пост в группе {i}',
+                                author=cls.author, group=cls.group)
+        cls.post = Post.objects.filter(author=cls.author).first()
+        for i in range(5):
+            Comment.objects.create(
+                text=f'Коммент {i}', post=cls.post,
+                author=User.objects.create_user(username=f'Commenter{i}'))
+
+    def setUp(self):
+        caches['posts'].clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_feed_views_query_count(self):
+        pages = (
+            (self.client, reverse('posts:index'), 2),
+            (self.client, reverse('posts:group_list',
+                                  kwargs={'slug': 'group'}), 3),
+            (self.client, reverse('posts:profile',
+                                  kwargs={'username': 'Author'}), 4),
+            (self.client, reverse('posts:post_detail',
+                                  kwargs={'post_id': self.post.pk}), 3),
+            (self.reader_client, reverse('posts:follow_index'), 5),
+        )
+        for client, address, queries in pages:
+            with self.subTest(address=address):
+                with self.assertNumQueries(queries):
+                    client.get(address)
+
+
+class PostCardCacheTest(TestCase):
+    """Карточки постов берутся из кэша фрагментов, пока пост не изменён."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Author')
+        cls.group = Group.objects.create(title='Коты', slug='cats')
+        cls.post = Post.objects.create(text='Карточка', author=cls.author,
+                                       group=cls.group)
+
+    def setUp(self):
+        caches['posts'].clear()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def cached_cards(self):
+        return caches['posts'].stats()['l1_hits']
+
+    def get_index(self, client=None):
+        # Страницу целиком сбрасываем, чтобы шаблон рендерился заново.
+        cache.clear()
+        return (client or self.client).get(reverse('posts:index'))
+
+    def test_card_is_shared_and_buttons_are_not_cached(self):
+        self.get_index()
+        hits = self.cached_cards()
+        response = self.get_index(self.author_client)
+        self.assertGreater(self.cached_cards(), hits)
+        self.assertContains(response, reverse(
+            'posts:post_edit', kwargs={'post_id': self.post.pk}))
+        response = self.get_index()
+        self.assertNotContains(response, reverse(
+            'posts:post_edit', kwargs={'post_id': self.post.pk}))
+
+    def test_post_and_group_changes_refresh_card(self):
+        self.get_index()
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Новый текст'
+        post.save()
+        self.assertContains(self.get_index(), 'Новый текст')
+        Comment.objects.create(text='Коммент', post=post, author=self.author)
+        self.assertContains(self.get_index(), 'Комментариев: 1')
+        self.group.title = 'Кошки'
+        self.group.save()
+        self.assertContains(self.get_index(), 'Все записи группы Кошки')
+
+    def test_author_rename_refreshes_cards_and_profiles(self):
+        old_profile = reverse('posts:profile', kwargs={'username': 'Author'})
+        self.assertEqual(self.client.get(old_profile).status_code, 200)
+        group_page = reverse('posts:group_list', kwargs={'slug': 'cats'})
+        self.client.get(group_page)
+        author = User.objects.get(pk=self.author.pk)
+        author.username = 'Writer'
+        author.first_name = 'Новое'
+        author.last_name = 'Имя'
+        author.save()
+        self.assertEqual(self.client.get(old_profile).status_code, 404)
+        self.assertContains(self.client.get(group_page), 'Новое Имя')
+        self.assertContains(self.client.get(reverse('posts:index')),
+                            'Новое Имя')
+
+    def test_unrelated_user_save_keeps_cache(self):
+        self.get_index()
+        post = Post.objects.get(pk=self.post.pk)
+        author = User.objects.get(pk=self.author.pk)
+        author.email = 'author@example.com'
+        author.save()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).modified,
+                         post.modified)
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Searcher')
+        cls.admin = User.objects.create_superuser(
+            'Admin', 'admin@example.com', 'password')
+        Post.objects.bulk_create([
+            Post(text=f'Кошка номер {i}', author=cls.user)
+            for i in range(12)
+        ] + [
+            Post(text='Кошка кошке кошку не обидит', author=cls.user),
+            Post(text='Собака лает', author=cls.user),
+        ])
+
+    def setUp(self):
+        caches['posts'].clear()
+
+    def search(self, query, cursor=None):
+        data = {'q': query}
+        if cursor:
+            data['cursor'] = cursor
+        return self.client.get(reverse('posts:search'), data)
+
+    def test_results_are_ranked_and_paginated(self):
+        first = self.search('кошк').context['page_obj']
+        self.assertEqual(len(first), 10)
+        self.assertEqual(first[0].text, 'Кошка кошке кошку не обидит')
+        second = self.search('кошк', first.next_cursor).context['page_obj']
+        self.assertEqual(len(second), 3)
+        self.assertFalse(second.has_next())
+        seen = {post.pk for post in first} | {post.pk for post in second}
+        self.assertEqual(seen, set(Post.objects.filter(
+            text__startswith='Кошка').values_list('pk', flat=True)))
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.get(text='Собака лает')
+        self.assertEqual(len(self.search('собака').context['page_obj']), 1)
+        post.text = 'Пёс молчит'
+        post.save()
+        self.assertEqual(len(self.search('собака').context['page_obj']), 0)
+        self.assertEqual(len(self.search('молчит').context['page_obj']), 1)
+        post.delete()
+        self.assertEqual(len(self.search('молчит').context['page_obj']), 0)
+
+    def test_query_syntax_is_not_interpreted(self):
+        for query in ('"', 'NOT кошка', '*', 'кошка OR', ''):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query).status_code, 200)
+
+    def test_missing_fts_triggers_fail_check(self):
+        self.assertEqual(check_fts_triggers(None), [])
+        # Так триггеры теряются, когда SQLite пересоздаёт posts_post.
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER posts_post_fts_update')
+        errors = check_fts_triggers(None)
+        self.assertEqual([error.id for error in errors], ['posts.E001'])
+        self.assertIn('posts_post_fts_update', errors[0].msg)
+
+    def test_admin_search_uses_index(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'лает'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class BenchCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='BenchAuthor')
+        reader = User.objects.create_user(username='BenchReader')
+        group = Group.objects.create(title='Группа', slug='bench')
+        Follow.objects.create(user=reader, author=author)
+        for i in range(3):
+            Post.objects.create(text=f'Пост {i}', author=author, group=group)
+
+    def setUp(self):
+        caches['posts'].clear()
+
+    def bench(self, **options):
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            call_command('bench', current_db=True, iterations=3, warmup=1,
+                         output=output.name, stdout=StringIO(), **options)
+            return json.load(output)
+
+    def test_report_has_percentiles_for_every_page(self):
+        report = self.bench()
+        self.assertEqual(set(report['results']), {
+            'index', 'index_page_2', 'group_list', 'profile', 'post_detail',
+            'follow_index', 'search'})
+        for name, result in report['results'].items():
+            with self.subTest(page=name):
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+                self.assertGreater(result['bytes'], 0)
+
+    def test_regression_fails_the_run(self):
+        baseline = self.bench(cold=True)
+        for result in baseline['results'].values():
+            result['p95_ms'] = 0
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as file_:
+            json.dump(baseline, file_)
+            file_.flush()
+            with self.assertRaisesMessage(CommandError, 'Регрессия'):
+                self.bench(baseline=file_.name)
+
+
+class LoadReportTest(TestCase):
+    def test_summary_counts_errors_and_buckets(self):
+        results = [
+            ('index', 0.004, None),
+            ('index', 0.150, None),
+            ('post_create', 0.030, 'HTTP 500'),
+            ('post_create', 7.0, 'ReadTimeout'),
+        ]
+        report = loadgen.summarize(results, elapsed=2)
+        self.assertEqual(report['all']['requests'], 4)
+        self.assertEqual(report['all']['rps'], 2)
+        self.assertEqual(report['post_create']['error_rate'], 1)
+        self.assertEqual(report['post_create']['errors'],
+                         {'HTTP 500': 1, 'ReadTimeout': 1})
+        self.assertEqual(report['index']['error_rate'], 0)
+        histogram = dict(report['all']['histogram'])
+        self.assertEqual(histogram[5], 1)
+        self.assertEqual(histogram[200], 1)
+        self.assertEqual(histogram[None], 1)
+
+    def test_mix_rejects_unknown_scenario(self):
+        self.assertEqual(loadgen.parse_mix('index=3,post_create'),
+                         [('index', 3), ('post_create', 1)])
+        with self.assertRaises(ValueError):
+            loadgen.parse_mix('index=1,delete=1')
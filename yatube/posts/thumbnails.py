@@ -0,0 +1,177 @@
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from PIL import features
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    EMPTY_VALUE, KVStore as CachedDbKVStore)
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core import tasks
+
+from . import caching
+from .models import Post
+
+
+def thumbnail_file(file_, geometry, **options):
+    """Файл превью, который get_thumbnail создал бы для этих параметров.
+
+    Повторяет нормализацию опций из ThumbnailBackend.get_thumbnail,
+    но не открывает исходник и ничего не генерирует.
+    """
+    backend = default.backend
+    source = ImageFile(file_)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(name, default.storage)
+
+
+def get_ready_thumbnail(file_, geometry, **options):
+    """Готовое превью из key-value хранилища sorl или None."""
+    if not file_:
+        return None
+    return default.kvstore.get(thumbnail_file(file_, geometry, **options))
+
+
+def get_ready_thumbnails(files, geometry, **options):
+    """Готовые превью нескольких картинок: {имя картинки: превью или None}.
+
+    Для хранилища cached_db ключи читаются одним get_many из кэша,
+    а промахи — одним запросом к таблице хранилища.
+    """
+    thumbnails = {
+        file_.name: thumbnail_file(file_, geometry, **options)
+        for file_ in files if file_
+    }
+    kvstore = default.kvstore
+    if not isinstance(kvstore, CachedDbKVStore):
+        return {name: kvstore.get(thumbnail)
+                for name, thumbnail in thumbnails.items()}
+    keys = {name: add_prefix(thumbnail.key)
+            for name, thumbnail in thumbnails.items()}
+    values = kvstore.cache.get_many(list(keys.values()))
+    missing = [key for key in keys.values() if key not in values]
+    if missing:
+        stored = dict(KVStoreModel.objects.filter(
+            key__in=missing).values_list('key', 'value'))
+        # Отсутствие тоже кэшируется, как это делает сам KVStore.
+        kvstore.cache.set_many(
+            {key: stored.get(key, EMPTY_VALUE) for key in missing},
+            sorl_settings.THUMBNAIL_CACHE_TIMEOUT,
+        )
+        values.update(stored)
+    ready = {}
+    for name, key in keys.items():
+        value = values.get(key)
+        ready[name] = (
+            deserialize_image_file(value)
+            if value and value != EMPTY_VALUE else None
+        )
+    return ready
+
+
+class ThumbnailResolver:
+    """Превью для всех постов страницы ленты.
+
+    Первый запрос превью загружает их сразу для всей страницы, остальные
+    берутся из памяти. Если все карточки страницы есть в кэше
+    фрагментов, обращений к хранилищу не будет вовсе.
+    """
+
+    def __init__(self, posts):
+        self.posts = posts
+        self._ready = {}
+
+    def get(self, file_, geometry, **options):
+        key = (geometry, tuple(sorted(options.items())))
+        if key not in self._ready:
+            self._ready[key] = get_ready_thumbnails(
+                [post.image for post in self.posts
+                 if not post.image_variants], geometry, **options)
+        ready = self._ready[key]
+        if file_.name in ready:
+            return ready[file_.name]
+        return get_ready_thumbnail(file_, geometry, **options)
+
+
+def variant_formats(file_):
+    """Исходный формат картинки и поддерживаемые Pillow дополнительные."""
+    formats = [default.backend._get_format(ImageFile(file_))]
+    for image_format in settings.IMAGE_VARIANT_FORMATS:
+        if image_format not in formats and features.check(
+                image_format.lower()):
+            formats.append(image_format)
+    return formats
+
+
+def generate_variants(file_):
+    """Создаёт варианты картинки для srcset и возвращает их описание
+    для Post.image_variants.
+    """
+    aspect_width, aspect_height = settings.IMAGE_VARIANT_ASPECT
+    variants = []
+    for image_format in variant_formats(file_):
+        for width in settings.IMAGE_VARIANT_WIDTHS:
+            height = round(width * aspect_height / aspect_width)
+            thumbnail = get_thumbnail(
+                file_, f'{width}x{height}', crop='center', upscale=True,
+                format=image_format)
+            variants.append({'name': thumbnail.name, 'width': width,
+                             'format': image_format})
+    return variants
+
+
+def generate_thumbnails(file_):
+    """Создаёт превью THUMBNAIL_GEOMETRIES и варианты для srcset;
+    возвращает значение для Post.image_variants.
+    """
+    for geometry, options in settings.THUMBNAIL_GEOMETRIES:
+        get_thumbnail(file_, geometry, **options)
+    return json.dumps(generate_variants(file_))
+
+
+def touch_posts(post_ids):
+    """Сбрасывает закэшированные карточки и страницы с этими постами."""
+    if not post_ids:
+        return
+    posts = Post.objects.filter(pk__in=post_ids)
+    posts.update(modified=timezone.now())
+    scopes = {caching.GLOBAL}
+    for username, slug in posts.values_list(
+            'author__username', 'group__slug'):
+        scopes.add(caching.author_scope(username))
+        if slug:
+            scopes.add(caching.group_scope(slug))
+    caching.bump(*scopes)
+
+
+def generate_post_thumbnails(post_id):
+    post = Post.objects.filter(pk=post_id).only('image').first()
+    if post is None or not post.image:
+        return
+    variants = generate_thumbnails(post.image)
+    # Картинку могли заменить, пока задача выполнялась.
+    Post.objects.filter(pk=post_id, image=post.image.name).update(
+        image_variants=variants)
+    touch_posts([post_id])
+
+
+def schedule_thumbnails(post):
+    """Ставит генерацию превью картинки поста в фоновый пул.
+
+    Пока превью не готовы, шаблоны показывают исходную картинку.
+    """
+    if post.image:
+        tasks.submit(generate_post_thumbnails, post.pk)
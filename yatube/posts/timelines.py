@@ -0,0 +1,273 @@
+import heapq
+import sqlite3
+from itertools import islice, takewhile
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F, QuerySet, Window
+from django.db.models.functions import RowNumber
+
+from .caching import bump, get_versions
+from .models import Follow, Post
+
+# Списки лежат в двухуровневом кэше posts, а версии — в общем default:
+# смена версии видна всем процессам сразу, а копии под старым ключом
+# в памяти процессов просто перестают читаться.
+TIMELINE_KEY = 'timeline:author:{}:{}'
+FOLLOWING_KEY = 'following:user:{}:{}'
+
+TIMELINES_SQL = """
+    SELECT id, author_id, pub_date FROM (
+        SELECT id, author_id, pub_date, ROW_NUMBER() OVER (
+            PARTITION BY author_id ORDER BY pub_date DESC, id DESC
+        ) AS position
+        FROM {table} WHERE author_id IN ({placeholders})
+    ) WHERE position <= %s
+"""
+
+
+def _following_scope(user_id):
+    return 'following:{}'.format(user_id)
+
+
+def _timeline_scope(author_id):
+    return 'timeline:{}'.format(author_id)
+
+
+def get_following_ids(user_id):
+    """Кэшированный список id авторов, на которых подписан пользователь."""
+    version, = get_versions([_following_scope(user_id)])
+    key = FOLLOWING_KEY.format(user_id, version)
+    posts_cache = caches['posts']
+    author_ids = posts_cache.get(key)
+    if author_ids is None:
+        author_ids = list(
+            Follow.objects.filter(user_id=user_id)
+            .values_list('author_id', flat=True)
+        )
+        posts_cache.set(key, author_ids, settings.TIMELINE_CACHE_TIMEOUT)
+    return author_ids
+
+
+def invalidate_following(user_id):
+    bump(_following_scope(user_id))
+
+
+def invalidate_timeline(author_id):
+    bump(_timeline_scope(author_id))
+
+
+def _supports_window_functions():
+    # Django 2.2 не выставляет supports_over_clause для SQLite,
+    # хотя оконные функции там есть начиная с 3.25.
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 25, 0)
+    return connection.features.supports_over_clause
+
+
+def _build_timelines(author_ids):
+    """Строит таймлайны нескольких авторов одним запросом с оконной
+    функцией; на базах без неё — по запросу на автора.
+    """
+    timelines = {author_id: [] for author_id in author_ids}
+    if _supports_window_functions():
+        sql = TIMELINES_SQL.format(
+            table=connection.ops.quote_name(Post._meta.db_table),
+            placeholders=', '.join(['%s'] * len(author_ids)),
+        )
+        posts = Post.objects.raw(
+            sql, [*author_ids, settings.TIMELINE_LENGTH])
+    else:
+        posts = (
+            post
+            for author_id in author_ids
+            for post in Post.objects.filter(author_id=author_id).order_by(
+                '-pub_date', '-id').only('author_id', 'pub_date')[
+                    :settings.TIMELINE_LENGTH]
+        )
+    for post in posts:
+        timelines[post.author_id].append(
+            (post.pub_date.timestamp(), post.pk))
+    # Внешний ORDER BY потребовал бы временного B-дерева по всем строкам,
+    # а таймлайны короткие: сортируем каждый здесь.
+    for timeline in timelines.values():
+        timeline.sort(reverse=True)
+    return timelines
+
+
+def get_timelines(author_ids):
+    """Ограниченные таймлайны авторов: списки (timestamp, post_id)
+    от новых к старым, не длиннее TIMELINE_LENGTH.
+    """
+    versions = get_versions(
+        [_timeline_scope(author_id) for author_id in author_ids])
+    keys = {TIMELINE_KEY.format(author_id, version): author_id
+            for author_id, version in zip(author_ids, versions)}
+    posts_cache = caches['posts']
+    cached = posts_cache.get_many(keys)
+    timelines = {keys[key]: timeline for key, timeline in cached.items()}
+    missing = [author_id for key, author_id in keys.items()
+               if key not in cached]
+    if missing:
+        built = _build_timelines(missing)
+        timelines.update(built)
+        posts_cache.set_many(
+            {key: built[author_id] for key, author_id in keys.items()
+             if author_id in built},
+            settings.TIMELINE_CACHE_TIMEOUT,
+        )
+    return timelines
+
+
+class MergedFeed:
+    """Лента подписок, собранная k-way слиянием таймлайнов авторов.
+
+    Таймлайны обрезаны, поэтому слияние точно только до «горизонта» —
+    самой свежей из последних записей обрезанных таймлайнов. Страницы
+    глубже горизонта читаются обычным SQL-запросом. Объект реализует
+    count() и срезы, так что его можно отдать в Paginator.
+    """
+
+    def __init__(self, author_ids):
+        self.author_ids = list(author_ids)
+        timelines = get_timelines(self.author_ids).values()
+        truncated = [
+            timeline[-1] for timeline in timelines
+            if len(timeline) >= settings.TIMELINE_LENGTH
+        ]
+        self.complete = not truncated
+        merged = heapq.merge(*timelines, reverse=True)
+        if truncated:
+            horizon = max(truncated)
+            merged = takewhile(lambda entry: entry >= horizon, merged)
+        self.window = [post_id for _, post_id in merged]
+
+    def _queryset(self):
+        return Post.objects.for_feed().filter(author_id__in=self.author_ids)
+
+    def count(self):
+        if self.complete:
+            return len(self.window)
+        return self._queryset().count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        if stop is not None and stop <= len(self.window):
+            post_ids = self.window[start:stop]
+            posts = self._queryset().in_bulk(post_ids)
+            return [posts[post_id] for post_id in post_ids
+                    if post_id in posts]
+        # Глубже горизонта: по stop постов каждого автора по индексу.
+        return LatestPerAuthor(
+            self._queryset(), ('-pub_date', '-id'))[index]
+
+
+def _count(queryset):
+    # Django считает queryset с аннотациями через подзапрос с GROUP BY,
+    # которому нужно временное B-дерево; по одним id счёт идёт по индексу.
+    if not isinstance(queryset, QuerySet):
+        return queryset.count()
+    return queryset.order_by().values('pk').count()
+
+
+class MergedQuerySets:
+    """Несколько queryset с одними и теми же полями сортировки как один
+    упорядоченный список: срез [start:stop] берёт первые stop строк
+    каждого и сливает их. Поддерживает то, что нужно Paginator
+    и CursorPaginator: count(), срезы, filter() и order_by().
+    Все поля сортировки должны идти в одном направлении.
+    """
+
+    def __init__(self, querysets, ordering):
+        self.querysets = list(querysets)
+        self.ordering = tuple(ordering)
+
+    def filter(self, *args, **kwargs):
+        return MergedQuerySets(
+            [queryset.filter(*args, **kwargs) for queryset in self.querysets],
+            self.ordering)
+
+    def order_by(self, *ordering):
+        return MergedQuerySets(
+            [queryset.order_by(*ordering) for queryset in self.querysets],
+            ordering)
+
+    def count(self):
+        return sum(_count(queryset) for queryset in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if len(self.querysets) == 1:
+            return list(self.querysets[0].order_by(*self.ordering)[index])
+        start, stop = index.start or 0, index.stop
+        key = attrgetter(*(name.lstrip('-') for name in self.ordering))
+        merged = heapq.merge(
+            *(queryset.order_by(*self.ordering)[:stop]
+              for queryset in self.querysets),
+            key=key, reverse=self.ordering[0].startswith('-'))
+        return list(islice(merged, start, stop))
+
+
+class LatestPerAuthor:
+    """Посты нескольких авторов в порядке ordering без сортировки всей
+    выборки: срез [start:stop] берёт не больше stop первых постов каждого
+    автора оконной функцией, которая идёт по индексу (author, -pub_date,
+    -id), и сливает их. Как и MergedQuerySets, поддерживает count(),
+    срезы, filter() и order_by(); поля ordering — поля Post или их
+    аннотации, все в одном направлении.
+    """
+
+    def __init__(self, queryset, ordering):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+
+    def filter(self, *args, **kwargs):
+        return LatestPerAuthor(
+            self.queryset.filter(*args, **kwargs), self.ordering)
+
+    def order_by(self, *ordering):
+        return LatestPerAuthor(self.queryset, ordering)
+
+    def count(self):
+        return _count(self.queryset)
+
+    def __len__(self):
+        return self.count()
+
+    def _post_ids(self, stop):
+        order_by = [
+            F(name[1:]).desc() if name.startswith('-') else F(name).asc()
+            for name in self.ordering
+        ]
+        rows = self.queryset.order_by().annotate(position=Window(
+            RowNumber(), partition_by=[F('author_id')], order_by=order_by,
+        )).values_list('id', 'position')
+        sql, params = rows.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT id FROM ({}) WHERE position <= %s'.format(sql),
+                [*params, stop])
+            return [post_id for post_id, in cursor.fetchall()]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        if stop is None or not _supports_window_functions():
+            return list(self.queryset.order_by(*self.ordering)[index])
+        posts = list(self.queryset.in_bulk(self._post_ids(stop)).values())
+        posts.sort(
+            key=attrgetter(*(name.lstrip('-') for name in self.ordering)),
+            reverse=self.ordering[0].startswith('-'))
+        return posts[start:stop]
@@ -0,0 +1,75 @@
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadhandler import (StopUpload,
+                                             TemporaryFileUploadHandler)
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """Пишет загружаемые файлы сразу на диск кусками и обрывает загрузку,
+    как только она превышает POST_UPLOAD_MAX_BYTES.
+
+    Если размер известен из Content-Length, тело запроса не читается
+    вовсе. Оборванная загрузка отмечается в request.upload_too_large.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.received = 0
+
+    def reject(self):
+        self.request.upload_too_large = True
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        if content_length > settings.POST_UPLOAD_MAX_BYTES:
+            self.reject()
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def receive_data_chunk(self, raw_data, start):
+        # Content-Length может не быть (chunked), поэтому считаем сами.
+        self.received += len(raw_data)
+        if self.received > settings.POST_UPLOAD_MAX_BYTES:
+            self.file.close()
+            self.reject()
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def _content_length(request):
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
+
+
+def limit_uploads(view):
+    """Подключает LimitedUploadHandler к view.
+
+    Обработчики загрузки нельзя менять после чтения request.POST, а
+    CsrfViewMiddleware читает его раньше view. Поэтому CSRF-проверка
+    переносится внутрь: view освобождается от middleware и проверяется
+    csrf_protect уже после замены обработчиков.
+
+    Тело, которое по Content-Length больше POST_UPLOAD_MAX_BYTES, не
+    читается, так что и CSRF-токена из него не достать. Такой запрос
+    view получает без CSRF-проверки: POST и FILES у него пустые, форма
+    не проходит валидацию и ничего не записывается, а пользователь видит
+    ошибку поля вместо страницы 403.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_too_large = False
+        request.upload_handlers = [LimitedUploadHandler(request)]
+        if (request.method == 'POST'
+                and _content_length(request) > settings.POST_UPLOAD_MAX_BYTES):
+            return view(request, *args, **kwargs)
+        return protected(request, *args, **kwargs)
+    return wrapper
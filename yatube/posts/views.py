@@ -1,42 +1,62 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
 from django.core.paginator import Paginator
+from django.db.models import F
 from django.shortcuts import get_object_or_404, redirect, render
 from django.http import HttpResponseRedirect
 
+from core.decorators import query_budget
+
+from . import caching
+from .counters import get_user_stats
+from .feeds import get_popular_following
 from .forms import PostForm, CommentForm
 from .models import Group, Post, User, Follow
+from .paginators import CursorPaginator
+from .search import search_posts
+from .thumbnails import ThumbnailResolver, schedule_thumbnails
+from .uploads import limit_uploads
+from .timelines import (LatestPerAuthor, MergedFeed, MergedQuerySets,
+                        get_following_ids)
 
 POST_COUNT = 10
 POST_THIRTY = 30
 
 
-def get_page_obj(post_list, request):
-    paginator = Paginator(post_list, POST_COUNT)
-    page_number = request.GET.get('page')
-    return {'page_obj': paginator.get_page(page_number)}
+def get_page_obj(post_list, request, ordering=('-pub_date', '-id')):
+    if settings.POSTS_PAGINATION == 'cursor':
+        paginator = CursorPaginator(post_list, POST_COUNT, ordering)
+        page_obj = paginator.get_page(request.GET.get('cursor'))
+    else:
+        paginator = Paginator(post_list, POST_COUNT)
+        page_obj = paginator.get_page(request.GET.get('page'))
+    return {'page_obj': page_obj, 'thumbnails': ThumbnailResolver(page_obj)}
 
 
-@cache_page(20, key_prefix='index_page')
+@query_budget(5)
+@caching.cache_feed(lambda request: [caching.GLOBAL])
 def index(request):
-    post_list = Post.objects.all()
+    post_list = Post.objects.for_feed()
     return render(request, "posts/index.html",
                   get_page_obj(post_list, request))
 
 
+@query_budget(5)
+@caching.cache_feed(
+    lambda request, slug: [caching.group_scope(slug)])
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, POST_COUNT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = group.posts.for_feed()
     context = {
         "group": group,
-        "page_obj": page_obj,
     }
+    context.update(get_page_obj(post_list, request))
     return render(request, "posts/group_list.html", context)
 
 
+@query_budget(11)
+@caching.cache_feed(
+    lambda request, username: [caching.author_scope(username)])
 def profile(request, username):
     author = get_object_or_404(User, username=username)
     if request.user.is_authenticated:
@@ -44,28 +64,44 @@ def profile(request, username):
             author=author, user=request.user).exists()
     else:
         follow = False
-    post_list = author.posts.all()
-    post_count = author.posts.count()
-    paginator = Paginator(post_list, POST_COUNT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = author.posts.for_feed()
+    stats = get_user_stats(author.pk)
     context = {
         "author": author,
-        "page_obj": page_obj,
-        "post_count": post_count,
+        "post_count": stats.posts_count,
+        'stats': stats,
         'following': follow,
     }
+    context.update(get_page_obj(post_list, request))
 
     return render(request, 'posts/profile.html', context)
 
 
+@query_budget(3)
+def search(request):
+    # Результаты упорядочены по релевантности, поэтому страницы всегда
+    # курсорные: OFFSET по рангу пришлось бы пересчитывать целиком.
+    query = request.GET.get('q', '').strip()
+    ordering = ('rank', 'id')
+    paginator = CursorPaginator(
+        search_posts(Post.objects.for_feed(), query), POST_COUNT, ordering)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'thumbnails': ThumbnailResolver(page_obj),
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@query_budget(5)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(Post.objects.for_feed(), pk=post_id)
     post_title = post.text[:POST_THIRTY]
     pub_date = post.pub_date
     author = post.author
-    author_post_count = author.posts.all().count()
-    comments = post.comments.all()
+    author_post_count = get_user_stats(author.pk).posts_count
+    comments = post.comments.select_related('author')
     form_comment = CommentForm()
     context = {
         'post': post,
@@ -79,29 +115,42 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def get_post_form(request, instance=None):
+    # Тело запроса разбирается при первом обращении к POST, и только после
+    # этого известно, не оборвана ли загрузка. Оборванная загрузка
+    # оставляет POST пустым, но форма всё равно должна показать ошибку.
+    data, files = request.POST, request.FILES
+    too_large = request.upload_too_large
+    return PostForm(
+        data if too_large else data or None,
+        files=files or None,
+        instance=instance,
+        upload_too_large=too_large,
+    )
+
+
+@query_budget(17)
 @login_required
+@limit_uploads
 def post_create(request):
-    form = PostForm(request.POST or None,
-                    files=request.FILES or None,
-                    )
+    form = get_post_form(request)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        schedule_thumbnails(post)
         return redirect('posts:profile', post.author)
     return render(request, 'posts/create_post.html', {'form': form})
 
 
+@query_budget(14)
 @login_required
+@limit_uploads
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     if post.author != request.user:
         return redirect("posts:post_detail", post.pk)
-    form = PostForm(
-        request.POST or None,
-        files=request.FILES or None,
-        instance=post
-    )
+    form = get_post_form(request, instance=post)
     context = {
         'post': post,
         'post_id': post_id,
@@ -114,10 +163,16 @@ def post_edit(request, post_id):
             context)
     post = form.save(commit=False)
     post.author = request.user
+    image_changed = 'image' in form.changed_data
+    if image_changed:
+        post.image_variants = ''
     post.save()
+    if image_changed:
+        schedule_thumbnails(post)
     return redirect('posts:post_detail', post_id)
 
 
+@query_budget(8)
 @login_required
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
@@ -130,6 +185,7 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@query_budget(11)
 @login_required
 def post_delete(request, post_id=None):
     post_to_delete = Post.objects.get(id=post_id)
@@ -137,14 +193,42 @@ def post_delete(request, post_id=None):
     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
+@query_budget(9)
 @login_required
 def follow_index(request):
-    sub_authors_posts = Post.objects.filter(
-        author__following__user=request.user)
+    # Тем, кто подписан на немногих авторов, ленту собираем слиянием
+    # кэшированных таймлайнов авторов; остальным читаем материализованную
+    # таблицу FeedEntry одним диапазоном индекса (user, -pub_date).
+    following = get_following_ids(request.user.pk)
+    if (settings.POSTS_PAGINATION != 'cursor'
+            and len(following) <= settings.FEED_MERGE_MAX_AUTHORS):
+        return render(request, 'posts/follow.html',
+                      get_page_obj(MergedFeed(following), request))
+    feed_ordering = ('-feed_date', '-feed_id')
+    sub_authors_posts = Post.objects.for_feed().filter(
+        feed_entries__user=request.user
+    ).annotate(
+        feed_date=F('feed_entries__pub_date'),
+        feed_id=F('feed_entries__post'),
+    ).order_by(*feed_ordering)
+    sources = [sub_authors_posts]
+    # Посты популярных авторов в FeedEntry не раскладываются (а записанные
+    # до того, как автор стал популярным, пропускаем): их читаем из постов
+    # и сливаем с лентой.
+    popular = get_popular_following(request.user.pk)
+    if popular:
+        popular_posts = LatestPerAuthor(
+            Post.objects.for_feed().filter(author_id__in=popular).annotate(
+                feed_date=F('pub_date'), feed_id=F('id')),
+            feed_ordering)
+        sources = [sub_authors_posts.exclude(author_id__in=popular),
+                   popular_posts]
     return render(request, 'posts/follow.html',
-                  get_page_obj(sub_authors_posts, request))
+                  get_page_obj(MergedQuerySets(sources, feed_ordering),
+                               request, feed_ordering))
 
 
+@query_budget(21)
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
@@ -154,6 +238,7 @@ def profile_follow(request, username):
     return redirect('posts:profile', username=username)
 
 
+@query_budget(9)
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
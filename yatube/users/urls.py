@@ -1,6 +1,8 @@
 from django.contrib.auth.views import LogoutView, LoginView, PasswordResetView
 from django.urls import path
 
+from core.decorators import query_budget
+
 from . import views
 
 app_name = "users"
@@ -8,14 +10,16 @@ app_name = "users"
 urlpatterns = [
     path(
         "logout/",
-        LogoutView.as_view(template_name="users/logged_out.html"),
+        query_budget(4)(
+            LogoutView.as_view(template_name="users/logged_out.html")),
         name="logout",
     ),
     path("login/",
-         LoginView.as_view(template_name="users/login.html"),
+         query_budget(6)(LoginView.as_view(template_name="users/login.html")),
          name="login"),
     path("password_reset/",
-         PasswordResetView.as_view(template_name="users/password_reset.html"),
+         query_budget(2)(PasswordResetView.as_view(
+             template_name="users/password_reset.html")),
          name="password_reset"),
     path("signup/", views.SignUp.as_view(), name="signup"),
 
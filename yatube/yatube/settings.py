@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,7 +69,7 @@ TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template_backends.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -147,10 +148,118 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Общий для всех воркеров хоста кэш в файле SQLite (WAL)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache_backends.SQLiteCache',
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'default.sqlite3')
+        ),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_SIZE': 256 * 1024 * 1024,
+        },
+    },
+    # Горячие фрагменты и списки постов: LRU в памяти процесса перед
+    # default; ключи здесь должны включать версию
+    'posts': {
+        'BACKEND': 'core.cache_backends.LayeredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 5000,
+            'L1_TIMEOUT': 60,
+        },
+    },
 }
 
+# Кэш страниц со stale-while-revalidate: сколько запись свежая, сколько
+# ещё её можно отдавать устаревшей, пока один воркер её перестраивает,
+# и сколько живёт блокировка перестройки
+CACHE_SWR_TIMEOUT = 60
+CACHE_SWR_STALE_TIMEOUT = 60 * 5
+CACHE_SWR_LOCK_TIMEOUT = 10
+# Как часто процесс сбрасывает счётчики hit/miss/stale в общий кэш, секунд
+CACHE_SWR_STATS_FLUSH_INTERVAL = 10
+
+# Страницы лент сверяются с версиями (общая, группы, автора), которые
+# меняются при любой записи, поэтому срок свежести большой
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+FEED_CACHE_STALE_TIMEOUT = 60 * 60
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
+
+# Загруженные картинки уменьшаются до IMAGE_UPLOAD_MAX_DIMENSION по большей
+# стороне, очищаются от метаданных и перекодируются с качеством
+# IMAGE_UPLOAD_QUALITY (не ниже IMAGE_UPLOAD_MIN_QUALITY), чтобы уложиться
+# в IMAGE_UPLOAD_MAX_BYTES
+IMAGE_UPLOAD_MAX_DIMENSION = 2560
+IMAGE_UPLOAD_MAX_BYTES = 2 * 1024 * 1024
+IMAGE_UPLOAD_QUALITY = 85
+IMAGE_UPLOAD_MIN_QUALITY = 60
+
+# Загрузка поста пишется на диск кусками и обрывается, как только превысит
+# POST_UPLOAD_MAX_BYTES; картинки с числом пикселей больше
+# IMAGE_UPLOAD_MAX_PIXELS отклоняются по заголовку, без декодирования
+POST_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+IMAGE_UPLOAD_MAX_PIXELS = 50 * 1000 * 1000
+
+# Превью картинок постов (геометрия и опции sorl-thumbnail) создаются в фоне
+# после загрузки; шаблоны запрашивают их теми же параметрами
+THUMBNAIL_GEOMETRIES = [
+    ('960x339', {'crop': 'center', 'upscale': True}),
+]
+
+# Варианты картинки поста для srcset: ширины с пропорциями карточки
+# и форматы помимо исходного (WebP — если Pillow собран с его поддержкой);
+# в src карточки идёт вариант ширины IMAGE_VARIANT_DEFAULT_WIDTH
+IMAGE_VARIANT_WIDTHS = (480, 960, 1440)
+IMAGE_VARIANT_ASPECT = (960, 339)
+IMAGE_VARIANT_FORMATS = ('WEBP',)
+IMAGE_VARIANT_DEFAULT_WIDTH = 960
+
+# Ширина заглушки картинки в пикселях: она встраивается в карточку
+# как data URI и растягивается, пока грузится настоящая картинка
+IMAGE_PLACEHOLDER_WIDTH = 24
+
+# Режим пагинации лент: 'page' — номера страниц (Paginator),
+# 'cursor' — keyset-пагинация по (pub_date, id) без COUNT и OFFSET
+POSTS_PAGINATION = os.getenv('POSTS_PAGINATION', 'page')
+
+# Фоновые задачи выполняются в пуле потоков процесса после коммита;
+# в eager-режиме — сразу, в текущем потоке
+BACKGROUND_TASKS_WORKERS = 2
+BACKGROUND_TASKS_EAGER = False
+
+# Материализованная лента подписок: до скольких подписчиков пост
+# раскладывается прямо в запросе, размер пачки фоновой рассылки и сколько
+# последних постов автора добавляется в ленту при подписке
+FEED_FANOUT_INLINE_LIMIT = 200
+FEED_FANOUT_BATCH_SIZE = 1000
+FEED_BACKFILL_SIZE = 100
+# Посты авторов, у которых подписчиков больше, по лентам не раскладываются
+# и подмешиваются в ленту при чтении; должно быть не меньше
+# FEED_FANOUT_INLINE_LIMIT
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+
+# Гибридная лента: при подписке не более чем на FEED_MERGE_MAX_AUTHORS
+# авторов лента собирается слиянием их кэшированных таймлайнов
+# длиной до TIMELINE_LENGTH постов
+FEED_MERGE_MAX_AUTHORS = 50
+TIMELINE_LENGTH = 200
+TIMELINE_CACHE_TIMEOUT = 60 * 60
+
+# Метрики запроса (SQL, шаблоны, кэш, превью): доля замеряемых запросов
+# от 0 до 1 и нужно ли отдавать их сотрудникам (is_staff) в заголовке
+# Server-Timing; строка с метриками пишется в лог core.middleware
+# с уровнем INFO
+SERVER_TIMING_SAMPLE_RATE = float(
+    os.getenv('SERVER_TIMING_SAMPLE_RATE', '0.1'))
+SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', '0') == '1'
+
+# Бюджеты SQL-запросов view (core.decorators.query_budget): превышение
+# пишется в лог со стеком запроса, а в строгом режиме — ошибка
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', '0') == '1'
+
+# manage.py test: строгий режим бюджетов и свой временный кэш default
+TEST_RUNNER = 'core.test_runner.TestRunner'